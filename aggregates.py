@@ -0,0 +1,139 @@
+# Pre-aggregated count cube for the Visualizations tab
+#
+# Counts are stored by (age, patient_sex, serious, reaction_meddra) once per dataset load, so the
+# charts sum a slice of the cube instead of grouping the raw rows on every rerun. A second, smaller
+# cube without the reaction axis counts reports for the severity chart.
+import os
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from filters import selected_sex_code
+from shared_store import freeze
+
+
+# patient_sex codes: 0 = unknown, 1 = male, 2 = female (anything else is treated as unknown)
+N_SEX_CODES = 3
+
+# Serious axis: index 0 = serious (code 1), index 1 = non-serious (any other code, as in filters.py)
+SEVERITY_CODES = [1, 2]
+SEVERITY_AXIS = {"Serious": 0, "Non-Serious": 1}
+
+AGE_BAND_YEARS = 5
+
+
+# Sum counts per whole year of age into bands of `band` years (every band from the first to the last
+# age with a count, so both backends return the same bands for the same selection)
+def age_band_counts(ages, counts, band=AGE_BAND_YEARS):
+    ages = np.asarray(ages, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    ages, counts = ages[counts > 0], counts[counts > 0]
+    if not len(ages):
+        return pd.Series([], index=pd.Index([], name="age", dtype=object), name="count", dtype=np.int64)
+    bands = ages // band
+    first = int(bands.min())
+    totals = np.bincount(bands - first, weights=counts, minlength=int(bands.max()) - first + 1).astype(np.int64)
+    starts = (first + np.arange(len(totals))) * band
+    labels = [f"{start}-{start + band - 1}" for start in starts]
+    return pd.Series(totals, index=pd.Index(labels, name="age"), name="count")
+
+
+def _count_cube(indices, shape):
+    counts = np.zeros(int(np.prod(shape)), dtype=np.uint32)
+    np.add.at(counts, np.ravel_multi_index(indices, shape), 1)
+    counts = counts.reshape(shape)
+
+    # Smallest unsigned type that can hold the largest cell
+    dtype = np.uint16 if counts.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    return counts.astype(dtype)
+
+
+# Built from report_model.ReportTables: reaction counts are distinct (report, reaction) pairs and
+# severity counts are distinct reports, not flattened rows
+class ReactionCube:
+    def __init__(self, tables):
+        reports = tables.reports
+
+        # Ages come binned by whole year (data_loader.normalize_ages), matching the integer steps of the
+        # sidebar slider; the cube's age axis runs from the youngest to the oldest bin
+        ages = reports["patient_age_bin"].to_numpy().astype(np.int64)
+        self.min_age = int(ages.min()) if len(ages) else 0
+        self.max_age = int(ages.max()) if len(ages) else 0
+        n_ages = self.max_age - self.min_age + 1
+        age_bins = ages - self.min_age
+
+        sex = reports["patient_sex"].to_numpy()
+        sex = np.where((sex >= 0) & (sex < N_SEX_CODES), sex, 0)
+        severity = (reports["serious"].to_numpy() != 1).astype(np.int64)
+
+        # Report counts by (age, sex, serious)
+        self.report_counts = _count_cube((age_bins, sex, severity), (n_ages, N_SEX_CODES, len(SEVERITY_CODES)))
+
+        # Reaction counts by (age, sex, serious, reaction), one per report and reaction
+        self.reactions = tables.reactions.terms
+        pair_reports = tables.reactions.report
+        self.counts = _count_cube(
+            (age_bins[pair_reports], sex[pair_reports], severity[pair_reports], tables.reactions.term),
+            (n_ages, N_SEX_CODES, len(SEVERITY_CODES), max(len(self.reactions), 1)))
+
+    def _slice(self, cube, age_range, genders, severity="All"):
+        low = max(int(np.ceil(age_range[0])), self.min_age) - self.min_age
+        high = min(int(np.floor(age_range[1])), self.max_age) - self.min_age
+        cube = cube[low:high + 1] if high >= low else cube[:0]
+
+        code = selected_sex_code(genders)
+        if code is not None:
+            cube = cube[:, code:code + 1]
+        if severity in SEVERITY_AXIS:
+            axis = SEVERITY_AXIS[severity]
+            cube = cube[:, :, axis:axis + 1]
+        return cube
+
+    # Reaction counts (largest first) for the age range and gender selection, like value_counts()
+    # (the Visualizations tab ignores the severity filter; batch reports can apply it)
+    def reaction_counts(self, age_range, genders, n=None, severity="All"):
+        totals = self._slice(self.counts, age_range, genders, severity).sum(axis=(0, 1, 2), dtype=np.int64)
+        order = np.argsort(-totals, kind="stable")
+        order = order[totals[order] > 0]
+        if n is not None:
+            order = order[:n]
+        return pd.Series(totals[order], index=pd.Index(self.reactions[order], name="reaction_meddra"), name="count")
+
+    # Serious (1) and non-serious (2) report counts for the age range and gender selection
+    def severity_counts(self, age_range, genders, severity="All"):
+        cube = self.report_counts
+        if severity in SEVERITY_AXIS:
+            # Keep both entries, with the excluded one zeroed
+            cube = cube * (np.arange(len(SEVERITY_CODES)) == SEVERITY_AXIS[severity])
+        totals = self._slice(cube, age_range, genders).sum(axis=(0, 1), dtype=np.int64)
+        return pd.Series(totals, index=pd.Index(SEVERITY_CODES, name="serious"), name="count")
+
+    # Reports per band of `band` whole years of age (labelled like "30-34"), for the age-distribution chart
+    def age_distribution(self, age_range, genders, band=AGE_BAND_YEARS, severity="All"):
+        low = max(int(np.ceil(age_range[0])), self.min_age)
+        totals = self._slice(self.report_counts, age_range, genders, severity).sum(axis=(1, 2), dtype=np.int64)
+        return age_band_counts(np.arange(low, low + len(totals)), totals, band)
+
+    # One .npy file per array, so other processes can memory-map the cube instead of rebuilding it
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "report_counts.npy"), self.report_counts)
+        np.save(os.path.join(directory, "counts.npy"), self.counts)
+        np.save(os.path.join(directory, "reactions.npy"), np.asarray(self.reactions, dtype=str))
+        np.save(os.path.join(directory, "age_bounds.npy"), np.array([self.min_age, self.max_age]))
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        cube = cls.__new__(cls)
+        cube.report_counts = np.load(os.path.join(directory, "report_counts.npy"), mmap_mode=mmap_mode)
+        cube.counts = np.load(os.path.join(directory, "counts.npy"), mmap_mode=mmap_mode)
+        cube.reactions = pd.Index(np.load(os.path.join(directory, "reactions.npy")).astype(object))
+        cube.min_age, cube.max_age = (int(bound) for bound in np.load(os.path.join(directory, "age_bounds.npy")))
+        return cube
+
+
+# data_key identifies the loaded dataset (path and file signature), so the tables aren't hashed
+@tracked_cache_resource(max_entries=4)
+def build_reaction_cube(_tables, data_key):
+    return freeze(ReactionCube(_tables))
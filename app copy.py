@@ -1,23 +1,34 @@
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import streamlit as st
 
+from name_index import as_name_index
 
+
+# The helpers take a name_index.NameIndex, built once with build_name_index, so each one reads a
+# slice of the year or name instead of scanning the whole frame (a plain names frame is scanned).
+# Plotly is imported by the helpers that draw with it, so the page itself starts without it.
 def top_names_plot(df, year=2000, n=10, width=800, height=600, variable='count'):
-    year_data = df[df['year'] == year].copy()
-    year_data['overall_rank'] = year_data[variable].rank(method='min', ascending=False).astype(int)
+    import plotly.express as px
+
+    names = as_name_index(df)
+    year_values = names.year_rows(year)[variable].to_numpy()
 
-    male_names = year_data[year_data['sex'] == 'M']
-    top_male = male_names.sort_values(variable, ascending=False).head(n)
-    top_male['sex_rank'] = range(1, n + 1)  # Rank within male names
+    # The index is ordered by count; other variables are sorted within the sex's rows for the year
+    if variable == 'count':
+        top_male = names.top_rows(year, 'M', n).copy()
+        top_female = names.top_rows(year, 'F', n).copy()
+    else:
+        top_male = names.top_rows(year, 'M').sort_values(variable, ascending=False).head(n)
+        top_female = names.top_rows(year, 'F').sort_values(variable, ascending=False).head(n)
+    top_male['sex_rank'] = range(1, len(top_male) + 1)  # Rank within male names
+    top_female['sex_rank'] = range(1, len(top_female) + 1)  # Rank within female names
 
-    female_names = year_data[year_data['sex'] == 'F']
-    top_female = female_names.sort_values(variable, ascending=False).head(n)
-    top_female['sex_rank'] = range(1, n + 1)  # Rank within female names
+    # Overall rank (ties share the best rank) = 1 + number of the year's names with a higher value
+    sorted_values = np.sort(year_values)
+    for top in (top_male, top_female):
+        top['overall_rank'] = len(sorted_values) - np.searchsorted(sorted_values, top[variable].to_numpy(), side='right') + 1
 
     df = pd.concat([top_male, top_female])
     df.sort_values(variable, ascending=False, inplace=True)
@@ -32,7 +43,9 @@ def top_names_plot(df, year=2000, n=10, width=800, height=600, variable='count')
 
 
 def name_frequencies_plot(df, year=200, width=800, height=600):
-    year_data = df[df['year'] == year].copy()
+    import plotly.express as px
+
+    year_data = as_name_index(df).year_rows(year)
     name_counts = year_data.groupby(['name', 'sex'])['count'].sum().reset_index()
     color_map = {"M": "#636EFA", "F": "#EF553B"}
 
@@ -59,7 +72,10 @@ def name_frequencies_plot(df, year=200, width=800, height=600):
     return fig
 
 def name_trend_plot(df, name='John', width=800, height=600):
-    name_data = df[df['name'] == name].copy()
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    name_data = as_name_index(df).name_rows(name)
     color_map = {"M": "#636EFA", "F": "#EF553B"}
 
     if name_data.empty:
@@ -69,7 +85,8 @@ def name_trend_plot(df, name='John', width=800, height=600):
         #sex_counts = name_data.groupby(['year', 'sex'])['count'].sum().reset_index()
 
         # Calculate total count per year and male-to-female ratio
-        yearly_counts = name_data.groupby(['year', 'sex']).sum()['count'].unstack(fill_value=0)
+        yearly_counts = name_data.groupby(['year', 'sex'])['count'].sum().unstack(fill_value=0)
+        yearly_counts = yearly_counts.reindex(columns=['M', 'F'], fill_value=0)
         yearly_counts['Total'] = yearly_counts['M'] + yearly_counts['F']
         yearly_counts['Male_Ratio'] = yearly_counts['M'] / yearly_counts['Total']
         yearly_counts['Female_Ratio'] = yearly_counts['F'] / yearly_counts['Total']
@@ -115,13 +132,13 @@ def name_trend_plot(df, name='John', width=800, height=600):
         return fig
 
 def name_sex_balance_plot(df, name='John'):
-    name_data = df[df['name'] == name].copy()
+    name_data = as_name_index(df).name_rows(name)
     color_map = {"M": "#636EFA", "F": "#EF553B"}
 
     if name_data.empty:
         print("Name not found in the dataset.")
     else:
-        sex_counts = name_data.groupby('sex').sum()['count']
+        sex_counts = name_data.groupby('sex')['count'].sum()
         male_count = sex_counts.get('M', 0)
         female_count = sex_counts.get('F', 0)
         total_count = male_count + female_count
@@ -166,7 +183,7 @@ def name_sex_balance_plot(df, name='John'):
             print("Insufficient data for gender dominance calculation.")
 
 def unique_names_summary(df, year=1977):
-    year_data = df[df['year'] == year].copy()
+    year_data = as_name_index(df).year_rows(year)
     total_names_per_sex = year_data.groupby('sex')['count'].sum()
     unique_names_per_sex = year_data.groupby('sex')['name'].nunique()
     percent_unique_names_per_sex = (unique_names_per_sex / total_names_per_sex) * 100
@@ -178,9 +195,10 @@ def unique_names_summary(df, year=1977):
     
     return output
 
+# ohw_data can be the full names data: one-hit wonders are found once, across all years, by the index
 def one_hit_wonders(ohw_data, year=1977):
     
-    ohw_year = ohw_data[ohw_data['year']==year]
+    ohw_year = as_name_index(ohw_data).one_hit_wonder_rows(year)
 
     if ohw_year.empty:
         print(f"No one-hit wonders found in {year}")
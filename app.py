@@ -1,46 +1,23 @@
 # Import necessary libraries
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
-
-# Load datasets
-# Assuming the two datasets are already available as ozempic_data and ozempic_reviews_data
-ozempic_data_path = 'Ozempic_openFDA_Data.csv'
-ozempic_reviews_data_path = 'Ozempic_Reviews_Drugs.csv'
-
-ozempic_data = pd.read_csv(ozempic_data_path)
-ozempic_reviews_data = pd.read_csv(ozempic_reviews_data_path)
-
-####
-# Preprocess the dataset: Filter age to a realistic range
-ozempic_data['patient_age'] = pd.to_numeric(ozempic_data['patient_age'], errors='coerce')  # Ensure numeric
-ozempic_data = ozempic_data[(ozempic_data['patient_age'] >= 0) & (ozempic_data['patient_age'] <= 120)]
-####
-
-
-###################################################
-
-from textblob import TextBlob
-
-# Generate sentiment labels
-def classify_sentiment(text):
-    if pd.isna(text):
-        return "neutral"
-    polarity = TextBlob(text).sentiment.polarity
-    if polarity > 0.1:
-        return "positive"
-    elif polarity < -0.1:
-        return "negative"
-    else:
-        return "neutral"
-
-# Apply sentiment classification
-ozempic_reviews_data["sentiment"] = ozempic_reviews_data["review_text"].apply(classify_sentiment)
-
+from app_data import load_app_data
+from charts import CHART_BACKENDS, SENTIMENT_COLORS, show_bar_chart, show_pie_chart
+from diagnostics import begin_run, diagnostics_requested, end_run, span
+from explorer import paginated_frame, paginated_table
+from export import EXPORT_FORMATS, cached_export, export_file_name, export_mime, export_rows
+from search_index import keyword_rows
+from sentiment import POSITIVE_THRESHOLD, classify_polarities
+from signals import SIGNAL_MIN_CHI_SQUARE, SIGNAL_MIN_PRR, SIGNAL_MIN_REPORTS, rank_signals
+from sketches import build_report_sketches
+from trends import PERIODS, trend_frames
 
 
+# Stage timings and cache counters for this rerun, shown in the sidebar "Diagnostics" panel
+# (only recorded with OZEMPIC_DIAGNOSTICS=1 or ?diagnostics=1 in the URL; see diagnostics.py)
+begin_run(diagnostics_requested())
 
 ###################################################
 
@@ -52,33 +29,41 @@ def main():
     This app allows users to explore adverse event data and user sentiment analysis for Ozempic.
     Use the filters and tabs to interact with the datasets and generate insights.
     """)
+
+    # Load datasets
+    # (after the title, so the page shows while a cold server builds its caches; see app_data.py and warmup.py)
+    data = load_app_data()
+    openfda_backend = data.openfda_backend
+    ozempic_reviews_data = data.reviews_data
+    ozempic_reviews_data_key = data.reviews_data_key
+    review_index = data.review_index
+    review_reactions = data.review_reactions
     
     # Sidebar filters (Unified for All Tabs)
     st.sidebar.header("Global Filters")
-    age_range = st.sidebar.slider("Age Range", int(ozempic_data["patient_age"].min()),
-                                   int(ozempic_data["patient_age"].max()), (30, 80))
+    with span("age bounds"):
+        min_age, max_age = openfda_backend.age_bounds()
+    age_range = st.sidebar.slider("Age Range", min_age, max_age, (30, 80))
     gender_filter = st.sidebar.multiselect("Gender", options=["Male", "Female"], default=["Male", "Female"])
     severity_filter = st.sidebar.selectbox("Event Severity", options=["All", "Serious", "Non-Serious"])
+    # Matplotlib charts are rendered on the server (and cached); Plotly charts are drawn by the browser
+    chart_backend = st.sidebar.radio("Chart Renderer", options=CHART_BACKENDS, horizontal=True)
+    # Exact counts come from the query backend; the streaming sketches (sketches.py) are bounded-memory
+    # estimates that ingest_openfda.py keeps up to date, and don't apply the age filter
+    counting_mode = st.sidebar.radio("Report Counts", options=["Exact", "Streaming sketches"], horizontal=True)
     
     # Data filtering
-    filtered_data = ozempic_data[
-        (ozempic_data["patient_age"] >= age_range[0]) &
-        (ozempic_data["patient_age"] <= age_range[1])
-    ]
-    if "Male" in gender_filter and "Female" not in gender_filter:
-        filtered_data = filtered_data[filtered_data["patient_sex"] == 1]
-    elif "Female" in gender_filter and "Male" not in gender_filter:
-        filtered_data = filtered_data[filtered_data["patient_sex"] == 2]
-    if severity_filter == "Serious":
-        filtered_data = filtered_data[filtered_data["serious"] == 1]
-    elif severity_filter == "Non-Serious":
-        filtered_data = filtered_data[filtered_data["serious"] == 0]
+    # All filters apply to the Data Explorer; the charts use only the age and gender filters
+    filter_key = (tuple(age_range), tuple(sorted(gender_filter)), severity_filter)
     
     # Main tabs
-    tab1, tab2, tab3 = st.tabs(["Overview", "Data Explorer", "Visualizations"])
+    # (the tabs track which one is open, so the Data Explorer's full openFDA frame is only loaded once
+    # that tab is opened)
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Overview", "Data Explorer", "Visualizations", "Trends", "Signals"],
+                                           key="main_tab", on_change="rerun")
     
     
-    with tab1:
+    with tab1, span("Overview tab"):
         # Overview Tab
         st.subheader("Welcome to my openFDA Ozempic Data Explorer")
         st.write("""
@@ -93,6 +78,8 @@ def main():
             - Explore the most frequently reported side effects and their severity.
             - Understand demographic distribution of adverse events.
             - Analyze patient sentiment (positive, neutral, negative) from Drugs.com reviews.
+            - Follow report volume and the top reactions by month or quarter in the **Trends** tab.
+            - Screen drug-reaction pairs for disproportionate reporting (PRR / ROR) in the **Signals** tab.
         - **Filter and Customize**:
             - Use sidebar filters to narrow the data by age range, gender, event severity, or keywords. (Some graphs are not affected by the sidebar filters)
             - Dynamically adjust visualizations to focus on specific subsets of the data.
@@ -109,6 +96,7 @@ def main():
                 - Identify the top side effects reported.
                 - Compare the proportion of serious vs. non-serious adverse events.
                 - Examine patient sentiment across reviews, including specific keywords like "weight loss" or "nausea."
+                - Compare the reactions patients mention in reviews with how often they are reported to FAERS.
         """)
 
         st.subheader("My Hope For This App")
@@ -120,88 +108,107 @@ def main():
 
     
     # Data Explorer Tab
-    with tab2:
-        st.subheader("Data Explorer")
-        st.write("openFDA Ozempic Dataset:")
-        st.dataframe(filtered_data)
-        st.download_button(
-            label="Download openFDA Dataset",
-            data=filtered_data.to_csv(index=False).encode('utf-8'),
-            file_name='filtered_ozempic_data.csv',
-            mime='text/csv',
-        )
+    if tab2.open:
+        with tab2, span("Data Explorer tab"):
+            st.subheader("Data Explorer")
+            st.write("openFDA Ozempic Dataset:")
+            # Only the current page of the filtered rows is sent to the browser
+            with span("openFDA explorer page"):
+                paginated_table(
+                    lambda start, stop, sort_column, ascending: openfda_backend.page(
+                        age_range, gender_filter, severity_filter, start, stop, sort_column, ascending),
+                    openfda_backend.count(age_range, gender_filter, severity_filter),
+                    openfda_backend.columns(),
+                    key="openfda",
+                )
+
+            # Downloads are only generated when clicked, then cached per dataset and filter state
+            export_format = st.selectbox("Download Format", options=list(EXPORT_FORMATS))
+            st.download_button(
+                label="Download openFDA Dataset",
+                data=lambda: cached_export(
+                    lambda fmt: openfda_backend.export(age_range, gender_filter, severity_filter, fmt),
+                    (openfda_backend.name, openfda_backend.data_key, filter_key), export_format),
+                file_name=export_file_name('filtered_ozempic_data', export_format),
+                mime=export_mime(export_format),
+            )
         
         
-        # Drugs.com Reviews Dataset
-        st.write("Drugs.com Reviews Dataset:")
-        st.dataframe(ozempic_reviews_data)
-        st.download_button(
-            label="Download Drugs.com Reviews Data",
-            data=ozempic_reviews_data.to_csv(index=False).encode('utf-8'),
-            file_name='ozempic_reviews_data.csv',
-            mime='text/csv',
-        )
+            # Drugs.com Reviews Dataset
+            st.write("Drugs.com Reviews Dataset:")
+            paginated_frame(ozempic_reviews_data, None, ozempic_reviews_data_key, key="reviews")
+            st.download_button(
+                label="Download Drugs.com Reviews Data",
+                data=lambda: cached_export(lambda fmt: export_rows(ozempic_reviews_data, None, fmt),
+                                           ozempic_reviews_data_key, export_format),
+                file_name=export_file_name('ozempic_reviews_data', export_format),
+                mime=export_mime(export_format),
+            )
     
     # Visualization Tab
-    with tab3:
+    with tab3, span("Visualizations tab"):
         
         st.subheader("Top 10 Most Reported Side Effects")
         
         # Use only gender and age filters for this chart
-        side_effects_data = ozempic_data[
-            (ozempic_data["patient_age"] >= age_range[0]) &
-            (ozempic_data["patient_age"] <= age_range[1])
-        ]
-        if "Male" in gender_filter and "Female" not in gender_filter:
-            side_effects_data = side_effects_data[side_effects_data["patient_sex"] == 1]
-        elif "Female" in gender_filter and "Male" not in gender_filter:
-            side_effects_data = side_effects_data[side_effects_data["patient_sex"] == 2]
-        
-        # Calculate Top 10 Side Effects
-        top_side_effects = side_effects_data["reaction_meddra"].value_counts().head(10)
+        # Calculate Top 10 Side Effects (counted once per report)
+        if counting_mode == "Exact":
+            with span("top reactions"):
+                top_side_effects = openfda_backend.top_reactions(age_range, gender_filter, n=10)
+        else:
+            with span("report sketches"):
+                report_sketches = build_report_sketches(openfda_backend.data_key)
+                sketch_bounds = report_sketches.error_bounds(gender_filter)
+            top_side_effects = report_sketches.top_reactions(gender_filter, n=10)["count"]
+            st.caption(f"Streaming estimates over all ages: each count may exceed the exact report count by up to "
+                       f"{sketch_bounds['top_reactions']:,.0f}.")
 
         # Plot the bar chart
-        fig, ax = plt.subplots()
-        top_side_effects.plot(kind="bar", ax=ax, color="skyblue", edgecolor="black")
-        ax.set_title("Top 10 Most Reported Side Effects")
-        ax.set_xlabel("Side Effects")
-        ax.set_ylabel("Frequency")
-        st.pyplot(fig)
+        with span("render top reactions chart"):
+            show_bar_chart(top_side_effects, "Top 10 Most Reported Side Effects", "Side Effects", "Frequency",
+                           colors="skyblue", backend=chart_backend)
         
         
 
         st.subheader("Serious vs. Non-Serious Adverse Events")
 
-        # Apply gender and age filters
-        severity_data = ozempic_data[
-            (ozempic_data["patient_age"] >= age_range[0]) &
-            (ozempic_data["patient_age"] <= age_range[1])
-        ]
-        if "Male" in gender_filter and "Female" not in gender_filter:
-            severity_data = severity_data[severity_data["patient_sex"] == 1]
-        elif "Female" in gender_filter and "Male" not in gender_filter:
-            severity_data = severity_data[severity_data["patient_sex"] == 2]
-        
+        # Same gender and age filters as the side effects chart
         # Debugging: Check the filtered data
         st.write("Filtered Data for Severity Chart:")
-        st.write(severity_data.head())  # Verify the data used for the chart
+        st.write(openfda_backend.chart_page(age_range, gender_filter, 0, 5))  # Verify the data used for the chart
 
-        # Calculate serious vs. non-serious counts
-        severity_counts = severity_data["serious"].value_counts()
+        # Calculate serious vs. non-serious counts (one per report)
+        if counting_mode == "Exact":
+            with span("severity counts"):
+                severity_counts = openfda_backend.severity_counts(age_range, gender_filter)
+        else:
+            severity_counts = report_sketches.severity_counts(gender_filter)
+            st.caption(f"Streaming estimates over all ages: distinct report counts within about "
+                       f"{sketch_bounds['distinct_reports_relative']:.1%} (one standard error).")
 
         # Handle cases where data might be empty
-        if not severity_counts.empty:
-            labels = ["Serious" if idx == 1 else "Non-Serious" for idx in severity_counts.index]
-            sizes = [severity_counts.get(1, 0), severity_counts.get(2, 0)]  # Proper mapping of 1 and 2
+        if severity_counts.sum() > 0:
+            labels = ["Serious", "Non-Serious"]
+            sizes = [severity_counts[1], severity_counts[2]]
         else:
             labels = ["No Data"]
             sizes = [1]
 
         # Plotting the pie chart
-        fig, ax = plt.subplots(figsize=(8, 8))
-        ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, colors=["orange", "skyblue"])
-        ax.set_title("Severity Distribution of Adverse Events")
-        st.pyplot(fig)
+        with span("render severity chart"):
+            show_pie_chart(labels, sizes, ["orange", "skyblue"], "Severity Distribution of Adverse Events",
+                           backend=chart_backend)
+
+
+        st.subheader("Patient Age Distribution")
+
+        # Same gender and age filters, in 5-year age bands (one count per report)
+        with span("age distribution"):
+            age_counts = openfda_backend.age_distribution(age_range, gender_filter)
+
+        with span("render age distribution chart"):
+            show_bar_chart(age_counts, "Reports by Patient Age", "Age (years)", "Reports", colors="slateblue",
+                           backend=chart_backend)
 
 
         # Sentiment Distribution Bar Chart
@@ -216,52 +223,143 @@ def main():
             options=["All", "Positive", "Neutral", "Negative"],
             index=0
         )
+
+        # Reviews with a polarity inside (-band, band) count as neutral
+        neutral_band = st.slider("Neutral Polarity Band:", 0.0, 0.5, POSITIVE_THRESHOLD, step=0.05)
         
         # Apply keyword filter first
-        sentiment_data = ozempic_reviews_data.copy()
-        if keyword_filter:
-            sentiment_data = sentiment_data[
-                sentiment_data["review_text"].str.contains(keyword_filter, case=False, na=False)
-            ]
+        # (looked up in the review index; keywords without any letters or digits fall back to a plain substring scan)
+        # Only the matching row positions and their polarity scores are taken from the shared reviews frame
+        with span("keyword filter"):
+            keyword_matches = keyword_rows(review_index, ozempic_reviews_data["review_text"], keyword_filter)
+        polarity = ozempic_reviews_data["polarity"].to_numpy()
+        if keyword_matches is not None:
+            polarity = polarity[keyword_matches]
         
-        # Check if the keyword filter resulted in an empty DataFrame
-        if sentiment_data.empty:
+        # Check if the keyword filter resulted in no reviews
+        if len(polarity) == 0:
             st.error("That word was not found in the Reviews.")
         else:
+            # Relabel from the stored polarity scores (changing the band never rescores the reviews)
+            sentiment = pd.Series(np.asarray(classify_polarities(np.nan_to_num(polarity), neutral_band, -neutral_band)),
+                                  name="sentiment")
+
             # Apply sentiment filter (only after keyword filter)
             if sentiment_filter != "All":
                 sentiment_map = {"Positive": "positive", "Neutral": "neutral", "Negative": "negative"}
-                sentiment_data = sentiment_data[
-                    sentiment_data["sentiment"] == sentiment_map[sentiment_filter]
-                ]
+                sentiment = sentiment[sentiment == sentiment_map[sentiment_filter]]
 
             # Count sentiment categories based on filtered data
-            sentiment_counts = sentiment_data["sentiment"].value_counts()
+            with span("sentiment value_counts"):
+                sentiment_counts = sentiment.value_counts()
 
             # Assign default colors for "All" view
-            color_map = {"positive": "green", "neutral": "gray", "negative": "red"}
             if sentiment_filter == "All":
-                colors = [color_map.get(sent, "blue") for sent in sentiment_counts.index]
+                colors = [SENTIMENT_COLORS.get(sent, "blue") for sent in sentiment_counts.index]
             else:
                 # Assign single color for filtered sentiment
-                colors = [color_map[sentiment_map[sentiment_filter]]]
+                colors = [SENTIMENT_COLORS[sentiment_map[sentiment_filter]]]
 
             # Plot the bar chart
-            fig3, ax = plt.subplots()
-            sentiment_counts.plot(kind="bar", ax=ax, color=colors, edgecolor="black")
-            ax.set_title(f"Sentiment Distribution in Reviews (Filtered by '{keyword_filter}' and {sentiment_filter})")
-            ax.set_xlabel("Sentiment")
-            ax.set_ylabel("Number of Reviews")
-            st.pyplot(fig3)
-
-            
-        
-        
-        
-        
-        
+            with span("render sentiment chart"):
+                show_bar_chart(sentiment_counts,
+                               f"Sentiment Distribution in Reviews (Filtered by '{keyword_filter}' and {sentiment_filter})",
+                               "Sentiment", "Number of Reviews", colors=colors, backend=chart_backend)
+
+
+        # Reactions mentioned in reviews vs. reported to FAERS
+        st.subheader("Reactions Mentioned in Reviews")
+        st.write("""
+        Reviews are matched to the openFDA reaction terms they mention (for example nausea or pancreatitis).
+        FAERS reports use the sidebar age and gender filters; review sentiment uses the polarity band above.
+        """)
+
+        review_labels = classify_polarities(ozempic_reviews_data["polarity"].fillna(0), neutral_band, -neutral_band)
+        mentions = review_reactions.label_counts(review_labels)
+        mentions.columns = [label.capitalize() for label in mentions.columns]
+        mentions.insert(0, "Reviews", mentions.sum(axis=1))
+        mentions = mentions[mentions["Reviews"] > 0].sort_values("Reviews", ascending=False, kind="stable")
+
+        if mentions.empty:
+            st.error("No reviews mention any of the reported reactions.")
+        else:
+            show_bar_chart(mentions["Reviews"].head(10), "Top 10 Reactions Mentioned in Reviews", "Reactions",
+                           "Number of Reviews", colors="mediumpurple", backend=chart_backend)
+
+            faers_counts = openfda_backend.top_reactions(age_range, gender_filter, n=len(review_reactions.reactions))
+            n_reports = int(openfda_backend.severity_counts(age_range, gender_filter).sum())
+            mentions.insert(1, "% of Reviews", mentions["Reviews"] / max(review_reactions.n_reviews, 1) * 100)
+            mentions["FAERS Reports"] = faers_counts.reindex(mentions.index, fill_value=0)
+            mentions["% of Reports"] = mentions["FAERS Reports"] / max(n_reports, 1) * 100
+            st.dataframe(mentions, column_config={
+                "% of Reviews": st.column_config.NumberColumn(format="%.1f%%"),
+                "% of Reports": st.column_config.NumberColumn(format="%.1f%%"),
+            })
+
+
+    # Trends Tab
+    with tab4, span("Trends tab"):
+        st.subheader("Report Trends Over Time")
+        st.write("Trends count the reports with a valid patient age (0-120 years) by the date the FDA received them "
+                 "(the sidebar filters are not applied).")
+
+        trend_controls = st.columns(3)
+        trend_period = trend_controls[0].radio("Period", options=list(PERIODS), horizontal=True)
+        rolling_window = trend_controls[1].slider("Rolling Window (periods)", 1, 12, 3)
+        top_n_reactions = trend_controls[2].slider("Top Reactions", 1, 15, 5)
+
+        # Built from the precomputed per-month counts, not regrouped from the raw rows
+        with span("trend frames"):
+            volume, top_reactions = trend_frames(openfda_backend.period_counts(), trend_period, rolling_window,
+                                                 top_n_reactions)
+        if volume.empty:
+            st.error("No reports with a receive date were found.")
+        else:
+            st.write("Report Volume:")
+            st.line_chart(volume[["Reports", f"Rolling Mean ({rolling_window})"]])
+
+            st.write("Year-over-Year Change in Reports:")
+            st.bar_chart(volume["YoY Change"].dropna())
+
+            st.write(f"Top {top_n_reactions} Reactions:")
+            st.line_chart(top_reactions)
+            st.dataframe(volume.join(top_reactions).sort_index(ascending=False))
+
+
+    # Signals Tab
+    with tab5, span("Signals tab"):
+        st.subheader("Disproportionality Signals")
+        st.write(f"""
+        For each drug and reaction, the proportional reporting ratio (PRR) and reporting odds ratio (ROR)
+        compare how often the reaction is reported with the drug against all other drugs in the dataset,
+        with 95% confidence intervals. Pairs with at least {SIGNAL_MIN_REPORTS} reports, PRR >= {SIGNAL_MIN_PRR:g}
+        and chi-square >= {SIGNAL_MIN_CHI_SQUARE:g} are flagged. The sidebar filters are not applied.
+        """)
+
+        with span("signals"):
+            signals = openfda_backend.signals()
+        if signals.empty:
+            st.error("No reports with both a drug and a reaction were found.")
+        else:
+            drugs = signals.groupby("drug", observed=True)["a"].sum().sort_values(ascending=False).index.tolist()
+            signal_controls = st.columns(3)
+            signal_drug = signal_controls[0].selectbox(
+                "Drug", options=drugs, index=drugs.index("OZEMPIC") if "OZEMPIC" in drugs else 0)
+            min_reports = signal_controls[1].number_input("Minimum Reports", min_value=1, value=SIGNAL_MIN_REPORTS)
+            flagged_only = signal_controls[2].checkbox("Flagged Signals Only")
+
+            ranked = rank_signals(signals, signal_drug, min_reports)
+            if flagged_only:
+                ranked = ranked[ranked["signal"]]
+            st.write(f"{len(ranked)} reactions, ranked by the lower bound of the ROR:")
+            st.dataframe(
+                ranked[["reaction", "a", "prr", "prr_lower", "prr_upper", "ror", "ror_lower", "ror_upper",
+                        "chi_square", "signal"]].rename(columns={"reaction": "Reaction", "a": "Reports"}),
+                hide_index=True,
+            )
 
 
 # Run the app
 if __name__ == "__main__":
     main()
+    end_run()
@@ -0,0 +1,44 @@
+# The datasets, indexes and aggregates behind app.py, fetched from (or built into) the shared caches
+#
+# app.py and the warm-up in warmup.py both go through load_app_data, so the warm-up builds exactly
+# the cache entries the app asks for.
+from data_loader import OZEMPIC_REVIEWS_DATA_PATH, file_signature, load_scored_reviews, resolve_openfda_path
+from diagnostics import span
+from query_backend import query_backend
+from review_reactions import build_review_reactions
+from search_index import build_review_index
+
+
+class AppData:
+    def __init__(self, openfda_backend, reviews_data, reviews_data_key, review_index, review_reactions):
+        self.openfda_backend = openfda_backend
+        self.reviews_data = reviews_data
+        self.reviews_data_key = reviews_data_key
+        self.review_index = review_index
+        self.review_reactions = review_reactions
+
+
+# Both loaders are cached across reruns and sessions, and reload only when the file on disk changes
+# (ages are converted to years and limited to 0-120 once inside the openFDA loader). The partitioned
+# Parquet copy from convert_data.py is used when it exists.
+def load_app_data(openfda_path=None, reviews_path=OZEMPIC_REVIEWS_DATA_PATH):
+    # Filtering and aggregation for the openFDA data go through the query backend: in-memory pandas with
+    # precomputed filter masks and count cube (default), or SQL pushed down to DuckDB (OZEMPIC_QUERY_BACKEND=duckdb)
+    with span("load openFDA data"):
+        openfda_backend = query_backend(openfda_path or resolve_openfda_path())
+    # Sentiment scores come from the precomputed sidecar file (see sentiment.py); only unseen reviews are scored.
+    # The scorer is chosen with OZEMPIC_SENTIMENT_SCORER ("textblob" or the faster "lexicon")
+    with span("load and score reviews"):
+        reviews_data = load_scored_reviews(reviews_path)
+
+    # Keyword index over the review texts, built once per reviews file
+    reviews_data_key = (reviews_path, file_signature(reviews_path))
+    with span("index reviews"):
+        review_index = build_review_index(reviews_data["review_text"], reviews_data_key)
+
+    # Which openFDA reaction terms each review mentions (one pass over the index for all terms)
+    with span("match reviews to reactions"):
+        review_reactions = build_review_reactions(review_index, openfda_backend.reaction_terms(),
+                                                  (reviews_data_key, openfda_backend.data_key))
+
+    return AppData(openfda_backend, reviews_data, reviews_data_key, review_index, review_reactions)
@@ -0,0 +1,200 @@
+# Headless batch reports: the Visualizations tab charts for many filter combinations
+#
+#     python batch_report.py -o reports --age-bands 0-17 18-44 45-64 65-120 \
+#         --sexes All Male Female --severities All Serious Non-Serious --keywords "" nausea "weight loss"
+#
+# Every combination of age band x sex x severity x keyword gets a directory with the top side
+# effects, the severity split and the review sentiment distribution, each as PNG, HTML (Plotly) and
+# CSV. index.csv lists the combinations with their report and review counts.
+#
+# The data is loaded and preprocessed once. The count cube, the review index and the review
+# polarity scores are then written as .npy / Feather files in a work directory, and every worker
+# process memory-maps them instead of receiving a pickled copy. Combinations are spread over a
+# process pool.
+import argparse
+import itertools
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from aggregates import ReactionCube
+from charts import SENTIMENT_COLORS, bar_chart_plotly, bar_chart_png, pie_chart_plotly, pie_chart_png
+from data_loader import (CHART_COLUMNS, OZEMPIC_REVIEWS_DATA_PATH, REVIEWS_DTYPES, prepare_openfda_data,
+                         read_openfda_file, resolve_openfda_path)
+from report_model import ReportTables
+from search_index import ReviewIndex, keyword_rows, tokenize
+from sentiment import NEGATIVE_THRESHOLD, POSITIVE_THRESHOLD, SENTIMENT_LABELS, attach_sentiment, classify_polarities
+
+
+OUTPUT_FORMATS = ["png", "html", "csv"]
+
+SEX_SELECTIONS = {"All": ["Male", "Female"], "Male": ["Male"], "Female": ["Female"]}
+
+SEVERITY_LABELS = ["Serious", "Non-Serious"]
+SEVERITY_COLORS = ["orange", "skyblue"]
+
+# Set in each worker by _init_worker
+_shared = {}
+
+
+# Preprocess once and write the shared files the workers memory-map
+def prepare_shared_data(work_dir, openfda_path, reviews_path):
+    chart_data = prepare_openfda_data(read_openfda_file(openfda_path, CHART_COLUMNS))
+    ReactionCube(ReportTables(chart_data)).save(os.path.join(work_dir, "cube"))
+
+    reviews = attach_sentiment(pd.read_csv(reviews_path, dtype=REVIEWS_DTYPES, encoding='utf-8-sig'))
+    ReviewIndex(reviews["review_text"]).save(os.path.join(work_dir, "review_index"))
+    reviews[["review_text", "polarity"]].reset_index(drop=True).to_feather(os.path.join(work_dir, "reviews.feather"))
+
+
+def _init_worker(work_dir):
+    import pyarrow.feather as feather
+
+    _shared["cube"] = ReactionCube.load(os.path.join(work_dir, "cube"))
+    _shared["review_index"] = ReviewIndex.load(os.path.join(work_dir, "review_index"))
+    _shared["reviews"] = feather.read_table(os.path.join(work_dir, "reviews.feather"), memory_map=True)
+
+
+# The review texts are only read for keywords the index can't answer
+def _review_texts(keyword):
+    if not keyword or tokenize(keyword):
+        return None
+    if "review_texts" not in _shared:
+        _shared["review_texts"] = _shared["reviews"].column("review_text").to_pandas()
+    return _shared["review_texts"]
+
+
+# Keywords without letters or digits (e.g. "!!") are spelled out in hex so they don't collide with "all"
+def _slug(value):
+    if not value:
+        return "all"
+    return re.sub(r"[^a-z0-9]+", "-", str(value).lower()).strip("-") or str(value).encode().hex()
+
+
+def combination_name(age_band, sex, severity, keyword):
+    return f"age_{age_band[0]}-{age_band[1]}__sex_{_slug(sex)}__severity_{_slug(severity)}__keyword_{_slug(keyword)}"
+
+
+def _write_chart(directory, name, frame, png, plotly_figure, formats):
+    if "csv" in formats:
+        frame.to_csv(os.path.join(directory, name + ".csv"))
+    if "png" in formats:
+        with open(os.path.join(directory, name + ".png"), "wb") as out:
+            out.write(png())
+    if "html" in formats:
+        plotly_figure().write_html(os.path.join(directory, name + ".html"), include_plotlyjs="cdn")
+
+
+# The three Visualizations tab charts for one combination (runs in a worker)
+def render_combination(output_dir, age_band, sex, severity, keyword, formats, top_n=10,
+                       positive=POSITIVE_THRESHOLD, negative=NEGATIVE_THRESHOLD):
+    cube, review_index = _shared["cube"], _shared["review_index"]
+    genders = SEX_SELECTIONS[sex]
+    directory = os.path.join(output_dir, combination_name(age_band, sex, severity, keyword))
+    os.makedirs(directory, exist_ok=True)
+
+    # Top side effects (reports per reaction)
+    top = cube.reaction_counts(age_band, genders, n=top_n, severity=severity)
+    title = f"Top {top_n} Most Reported Side Effects"
+    labels = tuple(str(label) for label in top.index)
+    values = tuple(int(value) for value in top.to_numpy())
+    colors = ("skyblue",) * len(values)
+    _write_chart(directory, "top_side_effects", top, lambda: bar_chart_png(labels, values, colors, title,
+                                                                            "Side Effects", "Frequency"),
+                 lambda: bar_chart_plotly(labels, values, colors, title, "Side Effects", "Frequency"), formats)
+
+    # Serious vs. non-serious reports
+    severity_counts = cube.severity_counts(age_band, genders, severity=severity)
+    sizes = tuple(int(size) for size in severity_counts.to_numpy())
+    pie_labels, pie_sizes = (tuple(SEVERITY_LABELS), sizes) if sum(sizes) > 0 else (("No Data",), (1,))
+    title = "Severity Distribution of Adverse Events"
+    severity_frame = pd.Series(sizes, index=pd.Index(SEVERITY_LABELS, name="severity"), name="reports")
+    _write_chart(directory, "severity", severity_frame,
+                 lambda: pie_chart_png(pie_labels, pie_sizes, tuple(SEVERITY_COLORS), title),
+                 lambda: pie_chart_plotly(pie_labels, pie_sizes, tuple(SEVERITY_COLORS), title), formats)
+
+    # Review sentiment for the keyword (reviews have no age/sex/severity, as in the app)
+    polarity = _shared["reviews"].column("polarity").to_numpy(zero_copy_only=False)
+    rows = keyword_rows(review_index, _review_texts(keyword), keyword)
+    if rows is not None:
+        polarity = polarity[rows]
+    labels = classify_polarities(np.nan_to_num(polarity), positive, negative)
+    sentiment = pd.Series(labels).value_counts().reindex(SENTIMENT_LABELS[::-1], fill_value=0)
+    sentiment.index.name = "sentiment"
+    title = f"Sentiment Distribution in Reviews (Filtered by '{keyword}')"
+    sentiment_labels = tuple(sentiment.index)
+    sentiment_values = tuple(int(value) for value in sentiment.to_numpy())
+    sentiment_colors = tuple(SENTIMENT_COLORS[label] for label in sentiment_labels)
+    _write_chart(directory, "sentiment", sentiment,
+                 lambda: bar_chart_png(sentiment_labels, sentiment_values, sentiment_colors, title, "Sentiment",
+                                       "Number of Reviews"),
+                 lambda: bar_chart_plotly(sentiment_labels, sentiment_values, sentiment_colors, title, "Sentiment",
+                                          "Number of Reviews"), formats)
+
+    return {
+        "age_min": age_band[0], "age_max": age_band[1], "sex": sex, "severity": severity, "keyword": keyword,
+        "reports": int(sum(sizes)), "reviews": len(polarity), "directory": os.path.basename(directory),
+    }
+
+
+def parse_age_band(text):
+    low, _, high = text.partition("-")
+    return int(low), int(high)
+
+
+def combinations(age_bands, sexes, severities, keywords):
+    return list(itertools.product(age_bands, sexes, severities, keywords))
+
+
+def run_batch(output_dir, age_bands, sexes, severities, keywords, formats=OUTPUT_FORMATS, workers=None,
+              openfda_path=None, reviews_path=OZEMPIC_REVIEWS_DATA_PATH, work_dir=None, top_n=10):
+    os.makedirs(output_dir, exist_ok=True)
+    owns_work_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix="batch_report_") if owns_work_dir else work_dir
+    try:
+        prepare_shared_data(work_dir, openfda_path or resolve_openfda_path(), reviews_path)
+
+        # Spawned workers start clean and only memory-map the shared files
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=_init_worker, initargs=(work_dir,)) as pool:
+            futures = [pool.submit(render_combination, output_dir, age_band, sex, severity, keyword, formats, top_n)
+                       for age_band, sex, severity, keyword in combinations(age_bands, sexes, severities, keywords)]
+            summary = pd.DataFrame([future.result() for future in futures])
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary.to_csv(os.path.join(output_dir, "index.csv"), index=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the Visualizations tab charts for many filter combinations.")
+    parser.add_argument("-o", "--output", default="reports", help="output directory")
+    parser.add_argument("--age-bands", nargs="+", default=["0-17", "18-44", "45-64", "65-120"],
+                        help="inclusive age bands, e.g. 18-44")
+    parser.add_argument("--sexes", nargs="+", choices=list(SEX_SELECTIONS), default=list(SEX_SELECTIONS))
+    parser.add_argument("--severities", nargs="+", choices=["All"] + SEVERITY_LABELS, default=["All"] + SEVERITY_LABELS)
+    parser.add_argument("--keywords", nargs="+", default=[""], help='review keywords ("" = all reviews)')
+    parser.add_argument("--formats", nargs="+", choices=OUTPUT_FORMATS, default=OUTPUT_FORMATS)
+    parser.add_argument("--top", type=int, default=10, help="side effects per chart")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--openfda", default=None, help="openFDA file (default: the app's)")
+    parser.add_argument("--reviews", default=OZEMPIC_REVIEWS_DATA_PATH, help="reviews CSV")
+    parser.add_argument("--work-dir", default=None, help="keep the shared memory-mapped files here")
+    args = parser.parse_args()
+
+    summary = run_batch(args.output, [parse_age_band(band) for band in args.age_bands], args.sexes, args.severities,
+                        args.keywords, formats=args.formats, workers=args.workers, openfda_path=args.openfda,
+                        reviews_path=args.reviews, work_dir=args.work_dir, top_n=args.top)
+    print(f"Wrote {len(summary)} reports to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
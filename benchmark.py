@@ -0,0 +1,328 @@
+# Headless benchmarks for the data paths behind app.py
+#
+#     python benchmark.py --rows 1000 10000 100000 1000000 -o bench.json
+#     python benchmark.py --rows 100000 --compare bench.json      # against an earlier run
+#
+# Each size runs in a fresh process on synthetic data from synthetic_data.py, and every stage
+# (load, filter, aggregate, keyword search, sentiment, ...) is timed on its own by calling the same
+# functions the app uses without the Streamlit caches. Results are written as JSON: wall time, peak
+# resident memory during the stage, and rows/sec, tagged with the git commit so runs from different
+# commits can be compared.
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from aggregates import ReactionCube
+from convert_data import read_openfda_csv, write_partitioned_parquet
+from data_loader import CHART_COLUMNS, REVIEWS_DTYPES, prepare_openfda_data, read_openfda_file
+from export import export_rows
+from filters import FilterEngine
+from report_model import ReportTables
+from review_reactions import ReviewReactions
+from search_index import ReviewIndex
+from sentiment import score_texts
+from signals import cooccurrence_counts, disproportionality
+from sketches import ReportSketches
+from synthetic_data import vocabulary, write_synthetic_data
+from trends import PeriodCounts, trend_frames
+
+
+BENCH_DATA_DIR = 'bench_data'
+
+# The sidebar combinations replayed by the filter and aggregate stages
+AGE_RANGES = [(0, 120), (18, 65), (30, 80), (40, 50), (65, 120)]
+GENDER_SELECTIONS = [["Male", "Female"], ["Male"], ["Female"]]
+SEVERITIES = ["All", "Serious", "Non-Serious"]
+KEYWORDS = ["nausea", "weight loss", "pancrea", "side effects", "blood sugar", "a1c", "injection site"]
+
+RSS_SAMPLE_SECONDS = 0.005
+
+
+# Resident set size in bytes (None where /proc isn't available)
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+# Process-wide peak RSS in bytes (ru_maxrss is in kilobytes on Linux, bytes on macOS)
+def max_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Samples the RSS in the background while a stage runs
+class RssSampler:
+    def __init__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.peak is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss() or 0)
+        else:
+            self.peak = max_rss()
+
+
+def _filter_grid():
+    return [(ages, genders, severity) for ages in AGE_RANGES for genders in GENDER_SELECTIONS
+            for severity in SEVERITIES]
+
+
+# Stages: name -> (function(state) returning the number of rows it processed, stages it needs).
+# Each function stores what later stages use in state.
+def stage_load(state):
+    df = read_openfda_file(state['openfda_path'], CHART_COLUMNS)
+    state['chart_data'] = prepare_openfda_data(df)
+    return len(df)
+
+
+def stage_load_full(state):
+    df = read_openfda_file(state['openfda_path'])
+    state['explorer_data'] = prepare_openfda_data(df)
+    return len(df)
+
+
+def stage_report_tables(state):
+    state['tables'] = ReportTables(state['chart_data'])
+    return len(state['chart_data'])
+
+
+def stage_filter_index(state):
+    state['filter_engine'] = FilterEngine(state['chart_data'])
+    return len(state['chart_data'])
+
+
+def stage_filter(state):
+    engine = state['filter_engine']
+    for age_range, genders, severity in _filter_grid():
+        state['selected_rows'] = engine.select(age_range, genders, severity)
+    return len(state['chart_data']) * len(_filter_grid())
+
+
+def stage_aggregate_index(state):
+    state['cube'] = ReactionCube(state['tables'])
+    return state['tables'].n_reports
+
+
+def stage_aggregate(state):
+    cube = state['cube']
+    for age_range, genders, _ in _filter_grid():
+        cube.reaction_counts(age_range, genders, n=10)
+        cube.severity_counts(age_range, genders)
+    return state['tables'].n_reports * len(_filter_grid())
+
+
+def stage_trends(state):
+    counts = PeriodCounts.from_tables(state['tables'])
+    trend_frames(counts, "Month")
+    trend_frames(counts, "Quarter")
+    return state['tables'].n_reports
+
+
+def stage_signals(state):
+    disproportionality(*cooccurrence_counts(state['tables']))
+    return state['tables'].n_reports
+
+
+def stage_sketches(state):
+    ReportSketches().add(state['tables'])
+    return state['tables'].n_reports
+
+
+def stage_export(state):
+    # (the chart and explorer frames come from the same file, so their row positions line up)
+    rows = state['filter_engine'].select(AGE_RANGES[2], GENDER_SELECTIONS[0], "All")
+    export_rows(state['explorer_data'], rows, "CSV")
+    return len(rows)
+
+
+def stage_review_load(state):
+    state['reviews'] = pd.read_csv(state['reviews_path'], dtype=REVIEWS_DTYPES, encoding='utf-8-sig')
+    return len(state['reviews'])
+
+
+def stage_review_index(state):
+    state['review_index'] = ReviewIndex(state['reviews']['review_text'])
+    return len(state['reviews'])
+
+
+def stage_keyword_search(state):
+    for keyword in KEYWORDS:
+        state['review_index'].match_keyword(keyword)
+    return len(state['reviews']) * len(KEYWORDS)
+
+
+def stage_sentiment(state):
+    score_texts(state['reviews']['review_text'], scorer=state['scorer'], workers=state['workers'])
+    return len(state['reviews'])
+
+
+def stage_review_reactions(state):
+    ReviewReactions(state['review_index'], state['tables'].reactions.terms)
+    return len(state['reviews'])
+
+
+STAGES = {
+    'load': (stage_load, []),
+    'load_full': (stage_load_full, []),
+    'report_tables': (stage_report_tables, ['load']),
+    'filter_index': (stage_filter_index, ['load']),
+    'filter': (stage_filter, ['filter_index']),
+    'aggregate_index': (stage_aggregate_index, ['report_tables']),
+    'aggregate': (stage_aggregate, ['aggregate_index']),
+    'trends': (stage_trends, ['report_tables']),
+    'signals': (stage_signals, ['report_tables']),
+    'sketches': (stage_sketches, ['report_tables']),
+    'export': (stage_export, ['load_full', 'filter_index']),
+    'review_load': (stage_review_load, []),
+    'review_index': (stage_review_index, ['review_load']),
+    'keyword_search': (stage_keyword_search, ['review_index']),
+    'sentiment': (stage_sentiment, ['review_load']),
+    'review_reactions': (stage_review_reactions, ['review_index', 'report_tables']),
+}
+
+
+# The selected stages plus everything they depend on, in STAGES order
+def stage_plan(selected):
+    needed = set()
+    pending = list(selected)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name][1])
+    return [name for name in STAGES if name in needed]
+
+
+def run_stage(name, state):
+    function = STAGES[name][0]
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        rows = function(state)
+        seconds = time.perf_counter() - start
+    return {
+        'stage': name,
+        'rows': int(rows),
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds > 0 else None,
+        'peak_rss_mb': sampler.peak / 2 ** 20 if sampler.peak is not None else None,
+    }
+
+
+# Run the stages for one dataset size (called in a fresh process, so memory numbers don't carry over)
+def run_size(n_rows, n_reviews, stages, data_dir=BENCH_DATA_DIR, data_format='csv', seed=0, scorer='lexicon',
+             workers=None):
+    openfda_path, reviews_path = write_synthetic_data(data_dir, n_rows, n_reviews, seed, vocab=vocabulary())
+    if data_format == 'parquet':
+        parquet_path = os.path.splitext(openfda_path)[0] + '.parquet'
+        if not os.path.exists(parquet_path):
+            write_partitioned_parquet(read_openfda_csv(openfda_path), parquet_path)
+        openfda_path = parquet_path
+
+    state = {'openfda_path': openfda_path, 'reviews_path': reviews_path, 'scorer': scorer, 'workers': workers}
+    results = []
+    for name in stage_plan(stages):
+        result = run_stage(name, state)
+        if name in stages:
+            results.append(dict(result, openfda_rows=n_rows, reviews=n_reviews, format=data_format))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, stages, reviews=None, **options):
+    results = []
+    for n_rows in sizes:
+        n_reviews = reviews if reviews is not None else n_rows
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            results.extend(pool.submit(run_size, n_rows, n_reviews, stages, **options).result())
+    return {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'results': results,
+    }
+
+
+# Per stage and size: seconds now vs. in the baseline run (ratio > 1 is slower)
+def compare_runs(baseline, current):
+    key = ['stage', 'openfda_rows', 'reviews', 'format']
+    before = pd.DataFrame(baseline['results'])
+    after = pd.DataFrame(current['results'])
+    if before.empty or after.empty:
+        return pd.DataFrame()
+    merged = after.merge(before, on=key, suffixes=('', '_baseline'))
+    merged['ratio'] = merged['seconds'] / merged['seconds_baseline']
+    return merged[key + ['seconds_baseline', 'seconds', 'ratio', 'peak_rss_mb_baseline', 'peak_rss_mb']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's data paths on synthetic data.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help="openFDA row counts to benchmark (10^3 to 10^7)")
+    parser.add_argument('--reviews', type=int, default=None, help="number of reviews (default: same as --rows)")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="openFDA file format to load")
+    parser.add_argument('--scorer', default='lexicon', help="sentiment scorer for the sentiment stage")
+    parser.add_argument('--workers', type=int, default=None, help="sentiment scoring processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR, help="where generated datasets are kept and reused")
+    parser.add_argument('-o', '--output', default=None, help="write the JSON results here (default: stdout)")
+    parser.add_argument('--compare', default=None, help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.rows, args.stages, reviews=args.reviews, data_dir=args.data_dir,
+                         data_format=args.format, seed=args.seed, scorer=args.scorer, workers=args.workers)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(run, out, indent=2)
+    else:
+        json.dump(run, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            comparison = compare_runs(json.load(baseline), run)
+        print(comparison.to_string(index=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
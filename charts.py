@@ -0,0 +1,103 @@
+# Chart rendering for the Visualizations tab
+#
+# Charts are keyed on their aggregated inputs (labels, values, styling). With the Matplotlib
+# backend the rendered PNG is kept in a bounded LRU cache, so an unchanged chart is not redrawn
+# on rerun. Figures are created without pyplot, so no figure is left registered (and leaking) in
+# the server process. The Plotly backend sends the data to the browser, which draws the chart.
+import io
+from functools import lru_cache
+
+import streamlit as st
+
+from diagnostics import register_lru_cache
+
+
+CHART_BACKENDS = ["Matplotlib", "Plotly"]
+
+SENTIMENT_COLORS = {"positive": "green", "neutral": "gray", "negative": "red"}
+
+# Same output as st.pyplot's defaults
+PNG_DPI = 200
+
+CHART_CACHE_SIZE = 64
+
+
+def _figure(figsize=None):
+    from matplotlib.figure import Figure
+
+    return Figure(figsize=figsize)
+
+
+def _to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=PNG_DPI, bbox_inches="tight")
+    fig.clear()
+    return buffer.getvalue()
+
+
+# All arguments are tuples/strings so the rendered chart can be cached on them
+@register_lru_cache
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def bar_chart_png(labels, values, colors, title, xlabel, ylabel):
+    fig = _figure()
+    ax = fig.subplots()
+    ax.bar(range(len(values)), values, color=list(colors), edgecolor="black")
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=90)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return _to_png(fig)
+
+
+@register_lru_cache
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def pie_chart_png(labels, sizes, colors, title):
+    fig = _figure(figsize=(8, 8))
+    ax = fig.subplots()
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, colors=list(colors))
+    ax.set_title(title)
+    return _to_png(fig)
+
+
+def bar_chart_plotly(labels, values, colors, title, xlabel, ylabel):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Bar(x=list(labels), y=list(values), marker_color=list(colors),
+                           marker_line_color="black", marker_line_width=1))
+    fig.update_layout(title=title, xaxis_title=xlabel, yaxis_title=ylabel)
+    return fig
+
+
+def pie_chart_plotly(labels, sizes, colors, title):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Pie(labels=list(labels), values=list(sizes), marker_colors=list(colors),
+                           texttemplate="%{percent:.1%}", sort=False, rotation=140))
+    fig.update_layout(title=title)
+    return fig
+
+
+# counts is a Series of values indexed by label; colors is one color or one per bar
+def show_bar_chart(counts, title, xlabel, ylabel, colors="skyblue", backend="Matplotlib"):
+    labels = tuple(str(label) for label in counts.index)
+    values = tuple(int(value) for value in counts.to_numpy())
+    if isinstance(colors, str):
+        colors = (colors,) * len(values)
+    colors = tuple(colors)
+
+    if backend == "Plotly":
+        st.plotly_chart(bar_chart_plotly(labels, values, colors, title, xlabel, ylabel))
+    else:
+        st.image(bar_chart_png(labels, values, colors, title, xlabel, ylabel), width="stretch")
+
+
+def show_pie_chart(labels, sizes, colors, title, backend="Matplotlib"):
+    labels = tuple(labels)
+    sizes = tuple(int(size) for size in sizes)
+    colors = tuple(colors)
+
+    if backend == "Plotly":
+        st.plotly_chart(pie_chart_plotly(labels, sizes, colors, title))
+    else:
+        st.image(pie_chart_png(labels, sizes, colors, title), width="stretch")
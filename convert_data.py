@@ -0,0 +1,54 @@
+# Convert the openFDA CSV into a columnar dataset the app can load column by column
+#
+#     python convert_data.py                                   # partitioned Parquet, one directory per year
+#     python convert_data.py --format feather -o Ozempic_openFDA_Data.feather
+#
+# The output keeps the compact dtypes from data_loader.py (categories, int8 flags, float32 numbers, parsed
+# receivedate). The age filter is not applied here so the file stays a faithful copy of the CSV.
+import argparse
+import os
+import shutil
+
+import pandas as pd
+
+from data_loader import OPENFDA_DTYPES, OZEMPIC_DATA_PATH, OZEMPIC_PARQUET_PATH, convert_openfda_types
+
+
+def read_openfda_csv(path):
+    df = pd.read_csv(path, dtype=OPENFDA_DTYPES, encoding='utf-8-sig')
+    return convert_openfda_types(df)
+
+
+# One sub-directory per receivedate year (receivedate_year=2018/...), so readers can skip whole years
+# (append=True adds files next to the existing ones, named by basename_template)
+def write_partitioned_parquet(df, output_path, append=False, basename_template=None):
+    df = df.assign(receivedate_year=df['receivedate'].dt.year.fillna(0).astype('int16'))
+    if os.path.exists(output_path) and not append:
+        shutil.rmtree(output_path)
+    options = {'basename_template': basename_template} if basename_template else {}
+    df.to_parquet(output_path, index=False, partition_cols=['receivedate_year'], **options)
+
+
+def write_feather(df, output_path):
+    df.reset_index(drop=True).to_feather(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the openFDA CSV to partitioned Parquet or Feather.")
+    parser.add_argument('input', nargs='?', default=OZEMPIC_DATA_PATH, help="openFDA CSV file")
+    parser.add_argument('-o', '--output', default=None, help="output directory (Parquet) or file (Feather)")
+    parser.add_argument('--format', choices=['parquet', 'feather'], default='parquet')
+    args = parser.parse_args()
+
+    df = read_openfda_csv(args.input)
+    if args.format == 'parquet':
+        output_path = args.output or OZEMPIC_PARQUET_PATH
+        write_partitioned_parquet(df, output_path)
+    else:
+        output_path = args.output or os.path.splitext(args.input)[0] + '.feather'
+        write_feather(df, output_path)
+    print(f"Wrote {len(df)} rows to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
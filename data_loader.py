@@ -0,0 +1,193 @@
+# Cached dataset loaders for the openFDA and Drugs.com data
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from sentiment import DEFAULT_SCORER, attach_sentiment
+
+
+OZEMPIC_DATA_PATH = 'Ozempic_openFDA_Data.csv'
+OZEMPIC_REVIEWS_DATA_PATH = 'Ozempic_Reviews_Drugs.csv'
+
+# Columnar copy written by convert_data.py (preferred over the CSV when present)
+OZEMPIC_PARQUET_PATH = 'Ozempic_openFDA_Data.parquet'
+
+# Columns used by the sidebar filters and the Visualizations tab
+# (safetyreportid groups the flattened rows back into reports, receivedate feeds the Trends tab,
+# drug_name the disproportionality signals, and patient_age_unit converts the ages to years)
+CHART_COLUMNS = ['safetyreportid', 'receivedate', 'patient_age', 'patient_age_unit', 'patient_sex', 'serious',
+                 'reaction_meddra', 'drug_name']
+
+# Explicit dtypes so pandas doesn't have to infer them (and store repeated strings as objects)
+OPENFDA_DTYPES = {
+    'safetyreportid': 'int64',
+    'reportercountry': 'category',
+    'reporterqualification': 'float32',
+    'patient_age_unit': 'category',
+    'reaction_meddra': 'category',
+    'drug_name': 'category',
+    'drug_admin_route': 'float32',
+    'drug_indication': 'category',
+}
+
+# Flag/code columns that are stored as int8 once missing values are filled
+OPENFDA_INT8_COLUMNS = ['serious', 'seriousnessdeath', 'patient_sex', 'drug_characterization']
+
+# Numeric columns that may be missing or fractional, stored as float32 (whatever type the source inferred)
+OPENFDA_FLOAT32_COLUMNS = ['patient_age', 'reporterqualification', 'drug_admin_route']
+
+REVIEWS_DTYPES = {
+    'review_text': 'string',
+}
+
+# openFDA patientonsetageunit codes, and the length of each unit in years. ingest_openfda.py writes
+# the unit names; older extracts may hold the codes. Ages without a unit are taken as years.
+AGE_UNIT_CODES = {'800': 'Decades', '801': 'Years', '802': 'Months', '803': 'Weeks', '804': 'Days', '805': 'Hours'}
+AGE_UNIT_YEARS = {'Decades': 10.0, 'Years': 1.0, 'Months': 1 / 12, 'Weeks': 7 / 365.25, 'Days': 1 / 365.25,
+                  'Hours': 1 / 8766}
+
+# Realistic ages, in years; patient_age_bin is the whole year of age (0-120) as a uint8 code
+MAX_AGE = 120
+N_AGE_BINS = MAX_AGE + 1
+
+# Columns added by the preprocessing, kept out of the Data Explorer and the downloads
+DERIVED_COLUMNS = ['patient_age_bin']
+
+
+# Identify the current version of a file (or partitioned dataset directory) so the caches below
+# are invalidated when it changes
+def file_signature(path, hash_contents=False):
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        return tuple((os.path.relpath(f, path), file_signature(f, hash_contents)) for f in files)
+
+    stat = os.stat(path)
+    if not hash_contents:
+        return (stat.st_mtime_ns, stat.st_size)
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return (stat.st_size, digest.hexdigest())
+
+
+# Use the columnar dataset if it has been generated, otherwise fall back to the CSV
+def resolve_openfda_path(csv_path=OZEMPIC_DATA_PATH, columnar_path=OZEMPIC_PARQUET_PATH):
+    if os.path.exists(columnar_path):
+        return columnar_path
+    return csv_path
+
+
+# Convert the raw openFDA columns into their compact types
+def convert_openfda_types(df):
+    for column in OPENFDA_INT8_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0).astype('int8')
+    for column in OPENFDA_FLOAT32_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float32')
+    if 'receivedate' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['receivedate']):
+        # (through nullable integers, so YYYYMMDD values stored as floats next to missing ones still parse)
+        dates = pd.to_numeric(df['receivedate'], errors='coerce').astype('Int64').astype('string')
+        df['receivedate'] = pd.to_datetime(dates, format='%Y%m%d', errors='coerce').astype('datetime64[us]')
+    return df
+
+
+# Years per unit for every row, looked up by category code (NaN for an unknown unit)
+def age_unit_factors(units):
+    units = units.astype('string').astype('category')
+    names = [AGE_UNIT_CODES.get(label, label) for label in units.cat.categories]
+    # (the extra last entry is for missing units, code -1)
+    factors = np.array([AGE_UNIT_YEARS.get(name, np.nan) for name in names] + [1.0])
+    return factors[units.cat.codes.to_numpy()]
+
+
+# Preprocess the dataset: convert ages to years, keep the realistic ones (0-120) and bin them by whole year.
+# patient_age and patient_age_unit keep the source's values; the filters and charts use patient_age_bin.
+def normalize_ages(df):
+    ages = pd.to_numeric(df['patient_age'], errors='coerce').to_numpy(dtype=np.float64)
+    if 'patient_age_unit' in df.columns:
+        ages = ages * age_unit_factors(df['patient_age_unit'])
+    keep = (ages >= 0) & (ages <= MAX_AGE)
+    df = df[keep].reset_index(drop=True)
+    df['patient_age_bin'] = np.floor(ages[keep]).astype(np.uint8)
+    return df
+
+
+def prepare_openfda_data(df):
+    return normalize_ages(convert_openfda_types(df))
+
+
+# Column names of the openFDA file, read from the Parquet/Feather schema or the CSV header
+def openfda_file_columns(path):
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        import pyarrow.dataset as ds
+
+        return ds.dataset(path, format='parquet', partitioning='hive').schema.names
+    if path.endswith('.feather'):
+        import pyarrow as pa
+
+        return pa.ipc.open_file(path).schema.names
+    return list(pd.read_csv(path, nrows=0, encoding='utf-8-sig').columns)
+
+
+def read_openfda_file(path, columns=None):
+    if columns is not None:
+        # The age normalization always needs patient_age, and its unit when the file has one (older
+        # extracts may not), even if the caller doesn't
+        unit = ['patient_age_unit'] if 'patient_age_unit' in openfda_file_columns(path) else []
+        columns = list(dict.fromkeys([c for c in columns if c != 'patient_age_unit'] + ['patient_age'] + unit))
+
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns, memory_map=True)
+        df = table.to_pandas()
+        if 'receivedate_year' in df.columns and (columns is None or 'receivedate_year' not in columns):
+            df = df.drop(columns='receivedate_year')
+    elif path.endswith('.feather'):
+        import pyarrow.feather as feather
+
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        dtypes = OPENFDA_DTYPES if columns is None else {c: t for c, t in OPENFDA_DTYPES.items() if c in columns}
+        df = pd.read_csv(path, dtype=dtypes, usecols=columns, encoding='utf-8-sig')
+    return df
+
+
+# The returned frames are shared by every session and rerun, so callers must not modify them in place
+@tracked_cache_resource(show_spinner="Loading openFDA data...", max_entries=4)
+def _load_openfda_data(path, signature, columns):
+    return prepare_openfda_data(read_openfda_file(path, columns))
+
+
+@tracked_cache_resource(show_spinner="Loading reviews...", max_entries=4)
+def _load_reviews_data(path, signature):
+    return pd.read_csv(path, dtype=REVIEWS_DTYPES, encoding='utf-8-sig')
+
+
+# Sentiment scores are deterministic per review text, so the reviews file alone decides the cache key
+# (the sidecar is only written for reviews it hasn't seen yet)
+@tracked_cache_resource(show_spinner="Scoring review sentiment...", max_entries=4)
+def _load_scored_reviews(path, signature, sidecar_path, scorer):
+    return attach_sentiment(_load_reviews_data(path, signature), path=sidecar_path, scorer=scorer)
+
+
+# Pass columns to load only what a tab needs (the Parquet/Feather paths then skip the other columns entirely)
+def load_openfda_data(path=OZEMPIC_DATA_PATH, columns=None):
+    if columns is not None:
+        columns = tuple(columns)
+    return _load_openfda_data(path, file_signature(path), columns)
+
+
+def load_reviews_data(path=OZEMPIC_REVIEWS_DATA_PATH):
+    return _load_reviews_data(path, file_signature(path))
+
+
+# scorer picks the sentiment scorer (see sentiment.SCORERS); sidecar_path defaults to that scorer's sidecar
+def load_scored_reviews(path=OZEMPIC_REVIEWS_DATA_PATH, sidecar_path=None, scorer=DEFAULT_SCORER):
+    return _load_scored_reviews(path, file_signature(path), sidecar_path, scorer)
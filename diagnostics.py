@@ -0,0 +1,221 @@
+# Per-rerun timing and cache counters for diagnosing slow reruns
+#
+# Wrap a stage in `with span("name"):` and decorate cached builders with tracked_cache_resource
+# instead of st.cache_resource. Nothing is recorded unless diagnostics are on for the rerun:
+#
+#     OZEMPIC_DIAGNOSTICS=1 streamlit run app.py      # for every session
+#     http://localhost:8501/?diagnostics=1             # for one session
+#
+# When they are off, span() hands back a shared no-op context manager and the cache wrappers
+# only increment a counter. When they are on, the sidebar gets a collapsed "Diagnostics" panel
+# with the span timings of the rerun and the cache hit/miss counts since the server started.
+# Each rerun can also be appended to a JSON-lines log (OZEMPIC_DIAGNOSTICS_LOG=path) and the
+# cumulative totals written in the Prometheus text format (OZEMPIC_DIAGNOSTICS_PROM=path, e.g.
+# for node_exporter's textfile collector).
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+
+DIAGNOSTICS_ENABLED = os.environ.get("OZEMPIC_DIAGNOSTICS", "") not in ("", "0")
+DIAGNOSTICS_LOG_PATH = os.environ.get("OZEMPIC_DIAGNOSTICS_LOG")
+DIAGNOSTICS_PROM_PATH = os.environ.get("OZEMPIC_DIAGNOSTICS_PROM")
+
+_NO_SPAN = contextlib.nullcontext()
+
+# Reruns run in one script thread per session, so each thread records its own rerun
+_local = threading.local()
+
+# Process-wide totals, shared by all sessions
+_lock = threading.Lock()
+_cache_counts = {}
+_span_totals = {}
+_lru_caches = {}
+_reruns = 0
+
+
+class RerunRecord:
+    def __init__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.stack = []
+        self.seconds = None
+
+    # Spans as a frame, nested spans named parent/child
+    def frame(self):
+        return pd.DataFrame(self.spans, columns=["span", "ms"])
+
+
+class _Span:
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        if self.record is not None:
+            self.record.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        path = self.name
+        if self.record is not None:
+            path = "/".join(self.record.stack)
+            self.record.stack.pop()
+            self.record.spans.append((path, seconds * 1000))
+        with _lock:
+            count, total = _span_totals.get(path, (0, 0.0))
+            _span_totals[path] = (count + 1, total + seconds)
+
+
+def diagnostics_requested():
+    return DIAGNOSTICS_ENABLED or st.query_params.get("diagnostics") == "1"
+
+
+# Start recording the current rerun (or turn recording off for it)
+def begin_run(enabled=True):
+    _local.record = RerunRecord() if enabled else None
+    return _local.record
+
+
+def current_run():
+    return getattr(_local, "record", None)
+
+
+# Outside a recorded rerun (e.g. a deferred download being generated) a span only adds to the
+# process-wide totals, and only when diagnostics are on for every session
+def span(name):
+    record = getattr(_local, "record", None)
+    if record is None and not DIAGNOSTICS_ENABLED:
+        return _NO_SPAN
+    return _Span(record, name)
+
+
+def _count_cache(name, field):
+    with _lock:
+        counts = _cache_counts.setdefault(name, {"calls": 0, "misses": 0})
+        counts[field] += 1
+
+
+# st.cache_resource that also counts calls and misses (the wrapped function only runs on a miss),
+# and records each miss as a span
+def tracked_cache_resource(**options):
+    def decorate(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            _count_cache(name, "misses")
+            with span(f"compute {name}"):
+                return func(*args, **kwargs)
+
+        cached = st.cache_resource(**options)(compute)
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            _count_cache(name, "calls")
+            return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+    return decorate
+
+
+# Also report a functools.lru_cache-wrapped function's hits and misses
+def register_lru_cache(func):
+    _lru_caches[func.__name__] = func
+    return func
+
+
+def cache_stats():
+    with _lock:
+        rows = [(name, counts["calls"] - counts["misses"], counts["misses"]) for name, counts in _cache_counts.items()]
+    rows += [(name, info.hits, info.misses) for name, info in
+             ((name, func.cache_info()) for name, func in _lru_caches.items())]
+    stats = pd.DataFrame(rows, columns=["cache", "hits", "misses"]).sort_values("cache", ignore_index=True)
+    return stats
+
+
+def _write_log(record, path):
+    entry = {
+        "time": record.started,
+        "seconds": record.seconds,
+        "spans": [{"span": name, "ms": round(ms, 3)} for name, ms in record.spans],
+        "caches": cache_stats().to_dict(orient="records"),
+    }
+    with open(path, "a") as log:
+        log.write(json.dumps(entry) + "\n")
+
+
+def _prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    with _lock:
+        spans = dict(_span_totals)
+        reruns = _reruns
+    stats = cache_stats()
+    lines = [
+        "# HELP ozempic_reruns_total Recorded script reruns.",
+        "# TYPE ozempic_reruns_total counter",
+        f"ozempic_reruns_total {reruns}",
+        "# HELP ozempic_span_seconds_total Time spent in each instrumented span.",
+        "# TYPE ozempic_span_seconds_total counter",
+    ]
+    lines += [f'ozempic_span_seconds_total{{span="{_prometheus_label(name)}"}} {total:.6f}'
+              for name, (_, total) in sorted(spans.items())]
+    lines += ["# HELP ozempic_span_count_total Times each instrumented span ran.",
+              "# TYPE ozempic_span_count_total counter"]
+    lines += [f'ozempic_span_count_total{{span="{_prometheus_label(name)}"}} {count}'
+              for name, (count, _) in sorted(spans.items())]
+    for field in ("hits", "misses"):
+        lines += [f"# HELP ozempic_cache_{field}_total Cache {field} per cached function.",
+                  f"# TYPE ozempic_cache_{field}_total counter"]
+        lines += [f'ozempic_cache_{field}_total{{cache="{_prometheus_label(row.cache)}"}} {getattr(row, field)}'
+                  for row in stats.itertuples()]
+    return "\n".join(lines) + "\n"
+
+
+# Written to a temporary file first, so a scraper never reads a half-written file
+def _write_prometheus(path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as out:
+        out.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def show_diagnostics_panel(record):
+    with st.sidebar.expander("Diagnostics", expanded=False):
+        st.write(f"Rerun: {record.seconds * 1000:.1f} ms")
+        st.dataframe(record.frame(), hide_index=True, column_config={
+            "ms": st.column_config.NumberColumn(format="%.1f")})
+        st.write("Caches (since server start):")
+        st.dataframe(cache_stats(), hide_index=True)
+
+
+# Finish the current rerun: show the panel and write the log / Prometheus file if configured
+def end_run():
+    global _reruns
+
+    record = current_run()
+    if record is None:
+        return
+    record.seconds = time.perf_counter() - record.start
+    _local.record = None
+    with _lock:
+        _reruns += 1
+
+    show_diagnostics_panel(record)
+    if DIAGNOSTICS_LOG_PATH:
+        _write_log(record, DIAGNOSTICS_LOG_PATH)
+    if DIAGNOSTICS_PROM_PATH:
+        _write_prometheus(DIAGNOSTICS_PROM_PATH)
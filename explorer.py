@@ -0,0 +1,77 @@
+# Server-side paginated tables for the Data Explorer tab
+#
+# Only the visible page of rows is sliced out and sent to the browser. Sort orders are computed
+# once per dataset and column, then restricted to the filtered rows with a boolean mask.
+import math
+
+import numpy as np
+import streamlit as st
+
+from shared_store import derived_results
+
+
+PAGE_SIZES = [25, 50, 100, 250, 500]
+
+
+# Row positions of the whole frame in sorted order (missing values last), kept in derived_results
+def sort_order(df, data_key, column, ascending):
+    def compute():
+        values = df[column].reset_index(drop=True)
+        return values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+    return derived_results.get(("sort_order", data_key, column, ascending), compute)
+
+
+# Restrict a full-frame sort order to the selected rows, keeping the sorted order
+def sorted_rows(df, rows, data_key, column, ascending):
+    order = sort_order(df, data_key, column, ascending)
+    if rows is None:
+        return order
+    selected = np.zeros(len(df), dtype=bool)
+    selected[rows] = True
+    return order[selected[order]]
+
+
+# The requested page of df (rows are positions, None = all rows), optionally sorted by a column
+def frame_page(df, rows, data_key, start, stop, sort_column=None, ascending=True):
+    if sort_column is not None:
+        page_rows = sorted_rows(df, rows, data_key, sort_column, ascending)[start:stop]
+    elif rows is None:
+        page_rows = np.arange(start, min(stop, len(df)))
+    else:
+        page_rows = rows[start:stop]
+    return df.iloc[page_rows]
+
+
+# Page, sort and column controls plus the visible page. fetch_page(start, stop, sort_column, ascending)
+# returns that slice of the (filtered) table, which has n_rows rows and the given columns.
+def paginated_table(fetch_page, n_rows, columns, key):
+    controls = st.columns(4)
+    selected_columns = controls[0].multiselect("Columns", options=columns, default=columns, key=f"{key}_columns")
+    sort_column = controls[1].selectbox("Sort By", options=["(none)"] + columns, key=f"{key}_sort")
+    ascending = controls[2].radio("Order", options=["Ascending", "Descending"], horizontal=True,
+                                  key=f"{key}_order") == "Ascending"
+    page_size = controls[3].selectbox("Rows per Page", options=PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    n_pages = max(math.ceil(n_rows / page_size), 1)
+    # Move back to the last page when the filters or page size leave fewer pages than before
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    page = int(st.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key))
+    start = (page - 1) * page_size
+    stop = min(start + page_size, n_rows)
+
+    page_data = fetch_page(start, stop, None if sort_column == "(none)" else sort_column, ascending)
+    st.dataframe(page_data[selected_columns or columns])
+    if n_rows:
+        st.caption(f"Rows {start + 1:,}–{stop:,} of {n_rows:,} (page {page} of {n_pages})")
+    else:
+        st.caption("No rows match the current filters.")
+
+
+# paginated_table over an in-memory frame
+def paginated_frame(df, rows, data_key, key):
+    n_rows = len(df) if rows is None else len(rows)
+    paginated_table(lambda start, stop, sort_column, ascending:
+                    frame_page(df, rows, data_key, start, stop, sort_column, ascending),
+                    n_rows, list(df.columns), key)
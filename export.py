@@ -0,0 +1,81 @@
+# On-demand exports for the Data Explorer download buttons
+#
+# Files are only built when a download button is clicked, written chunk by chunk (so the whole
+# frame never exists as one big CSV string), and cached per dataset/filter state.
+import gzip
+import io
+
+from shared_store import derived_results
+
+
+EXPORT_CHUNK_ROWS = 100_000
+
+EXPORT_FORMATS = {
+    "CSV": {"extension": ".csv", "mime": "text/csv"},
+    "CSV (gzip)": {"extension": ".csv.gz", "mime": "application/gzip"},
+    "Parquet": {"extension": ".parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def _row_chunks(df, rows, chunk_rows):
+    n = len(df) if rows is None else len(rows)
+    for start in range(0, n, chunk_rows):
+        if rows is None:
+            yield df.iloc[start:start + chunk_rows]
+        else:
+            yield df.iloc[rows[start:start + chunk_rows]]
+
+
+def write_csv(empty, chunks, out):
+    header = True
+    for chunk in chunks:
+        out.write(chunk.to_csv(index=False, header=header).encode("utf-8"))
+        header = False
+    if header:
+        # Nothing matched the filters: still write the header row
+        out.write(empty.to_csv(index=False).encode("utf-8"))
+
+
+def write_parquet(empty, chunks, out):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(empty, preserve_index=False)
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+# Encode a stream of frame chunks in one of EXPORT_FORMATS and return the bytes
+# (empty is a zero-row frame with the output columns, used for the header/schema)
+def export_chunks(empty, chunks, export_format="CSV"):
+    buffer = io.BytesIO()
+    if export_format == "CSV":
+        write_csv(empty, chunks, buffer)
+    elif export_format == "CSV (gzip)":
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6) as out:
+            write_csv(empty, chunks, out)
+    elif export_format == "Parquet":
+        write_parquet(empty, chunks, buffer)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return buffer.getvalue()
+
+
+# Encode df (or only the given row positions) in one of EXPORT_FORMATS
+def export_rows(df, rows=None, export_format="CSV", chunk_rows=EXPORT_CHUNK_ROWS):
+    return export_chunks(df.iloc[:0], _row_chunks(df, rows, chunk_rows), export_format)
+
+
+# build(export_format) returns the file bytes; export_key identifies the dataset and filter state
+# it exports, so the data itself isn't hashed (files are kept in derived_results, within its memory budget)
+def cached_export(build, export_key, export_format):
+    return derived_results.get(("export", export_key, export_format), lambda: build(export_format))
+
+
+def export_file_name(base_name, export_format):
+    return base_name + EXPORT_FORMATS[export_format]["extension"]
+
+
+def export_mime(export_format):
+    return EXPORT_FORMATS[export_format]["mime"]
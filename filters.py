@@ -0,0 +1,97 @@
+# Shared filter engine for the sidebar filters (age range, gender, severity)
+#
+# The per-value masks are built once per dataset load; each filter combination is then a few
+# numpy boolean ops, and the resulting row positions are shared by every tab.
+import math
+
+import numpy as np
+
+from data_loader import N_AGE_BINS
+from diagnostics import tracked_cache_resource
+from shared_store import derived_results, freeze
+
+
+SEX_CODES = {"Male": 1, "Female": 2}
+
+
+# Only one gender selected filters on it; both, neither or None leave the data unfiltered
+def selected_sex_code(genders):
+    if genders is None:
+        return None
+    selected = [SEX_CODES[g] for g in SEX_CODES if g in genders]
+    if len(selected) == 1:
+        return selected[0]
+    return None
+
+
+class FilterEngine:
+    def __init__(self, df):
+        self.n_rows = len(df)
+
+        # Rows ordered by whole-year age bin, with the cumulative row count before each bin, so an age
+        # range is one contiguous slice of age_order
+        age_bins = df["patient_age_bin"].to_numpy()
+        self.age_order = np.argsort(age_bins, kind="stable")
+        self.age_bin_offsets = np.concatenate([[0], np.cumsum(np.bincount(age_bins, minlength=N_AGE_BINS))])
+
+        sex = df["patient_sex"].to_numpy()
+        self.sex_masks = {code: sex == code for code in SEX_CODES.values()}
+
+        # openFDA codes non-serious reports as 2 (older extracts use 0), so anything other than 1 is non-serious
+        serious = df["serious"].to_numpy()
+        self.severity_masks = {"Serious": serious == 1, "Non-Serious": serious != 1}
+
+        self.all_rows = np.arange(self.n_rows)
+        self.all_rows.flags.writeable = False
+        # Selections are kept in the shared derived_results cache, under this engine's token
+        self._cache_token = object()
+
+    # Youngest and oldest age bin with any rows
+    def age_bounds(self):
+        occupied = np.flatnonzero(np.diff(self.age_bin_offsets))
+        return (int(occupied[0]), int(occupied[-1])) if len(occupied) else None
+
+    # Rows whose whole-year age falls in the inclusive [low, high] range, as a boolean mask
+    def age_mask(self, age_range):
+        low = max(math.ceil(age_range[0]), 0)
+        high = min(math.floor(age_range[1]), N_AGE_BINS - 1)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        if high >= low:
+            mask[self.age_order[self.age_bin_offsets[low]:self.age_bin_offsets[high + 1]]] = True
+        return mask
+
+    def sex_mask(self, genders):
+        code = selected_sex_code(genders)
+        return self.sex_masks[code] if code is not None else None
+
+    def severity_mask(self, severity):
+        return self.severity_masks.get(severity)
+
+    def _selected_rows(self, age_range, genders, severity):
+        mask = None
+        parts = [
+            self.age_mask(age_range) if age_range is not None else None,
+            self.sex_mask(genders),
+            self.severity_mask(severity),
+        ]
+        for part in parts:
+            if part is not None:
+                mask = part.copy() if mask is None else np.logical_and(mask, part, out=mask)
+        return self.all_rows if mask is None else np.flatnonzero(mask)
+
+    # Sorted row positions matching all the filters; use df.iloc[rows] (or a single column's .iloc) to read them
+    # (read-only, since the same array is handed to every session with the same filters)
+    def select(self, age_range=None, genders=None, severity="All"):
+        key = (tuple(age_range) if age_range is not None else None,
+               tuple(sorted(genders)) if genders is not None else None,
+               severity)
+        if key == (None, None, "All"):
+            return self.all_rows
+        return derived_results.get((self._cache_token, "select", key),
+                                   lambda: self._selected_rows(age_range, genders, severity))
+
+
+# data_key identifies the loaded dataset (path and file signature), so the frame itself isn't hashed
+@tracked_cache_resource(max_entries=4)
+def build_filter_engine(_df, data_key):
+    return freeze(FilterEngine(_df))
@@ -0,0 +1,327 @@
+# Incremental ingestion of openFDA drug-event bulk downloads
+#
+# Reads the zipped JSON files from https://open.fda.gov/data/downloads/ (drug-event-*.json.zip)
+# one report at a time, flattens each report into one row per (reaction, drug) using the columns
+# of Ozempic_openFDA_Data.csv, and appends only reports whose safetyreportid is not stored yet.
+#
+#     python ingest_openfda.py drug-event-0001-of-0030.json.zip drug-event-0002-of-0030.json.zip
+#     python ingest_openfda.py downloads/*.json.zip --output Ozempic_openFDA_Data.parquet
+#     python ingest_openfda.py --check          # ingest sample reports into a new CSV and Parquet and load them back
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import uuid
+import zipfile
+
+import pandas as pd
+
+from convert_data import write_partitioned_parquet
+from data_loader import (AGE_UNIT_CODES, OPENFDA_DTYPES, OZEMPIC_DATA_PATH, convert_openfda_types, file_signature,
+                         prepare_openfda_data, read_openfda_file)
+from report_model import ReportTables
+from sketches import SKETCHES_PATH, load_synced_sketches
+from trends import TREND_COUNTS_PATH, load_synced_counts
+
+
+OPENFDA_COLUMNS = [
+    'safetyreportid', 'serious', 'seriousnessdeath', 'receivedate', 'reportercountry',
+    'reporterqualification', 'patient_age', 'patient_age_unit', 'patient_sex', 'reaction_meddra',
+    'drug_name', 'drug_characterization', 'drug_admin_route', 'drug_indication',
+]
+
+RESULTS_START = re.compile(r'"results"\s*:\s*\[')
+
+READ_CHUNK_CHARS = 1 << 20
+
+BATCH_REPORTS = 10_000
+
+# Columns flatten_report stores as integers or None; the CSV gets them as nullable integers, since a
+# missing value would otherwise turn the whole column into floats (receivedate 20190101.0 no longer
+# parses as YYYYMMDD)
+CSV_INTEGER_COLUMNS = ['safetyreportid', 'serious', 'seriousnessdeath', 'receivedate', 'reporterqualification',
+                       'patient_sex', 'drug_characterization']
+
+
+# Yield the objects of the top-level "results" array without loading the whole file
+def iter_results(text_stream, chunk_chars=READ_CHUNK_CHARS):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+
+    # Skip the "meta" header up to the start of the results array
+    while True:
+        match = RESULTS_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        if eof:
+            return
+        chunk = text_stream.read(chunk_chars)
+        eof = not chunk
+        buffer = buffer[-64:] + chunk  # keep a tail in case the key is split across chunks
+
+    pos = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos >= len(buffer):
+                raise ValueError("need more data")
+            report, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if eof:
+                raise ValueError("Truncated openFDA file: results array is not closed")
+            chunk = text_stream.read(chunk_chars)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield report
+
+
+# Reports from a .json.zip bulk file (every .json member) or a plain .json file
+def iter_reports(path):
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith('.json'):
+                    with archive.open(member) as raw:
+                        yield from iter_results(io.TextIOWrapper(raw, encoding='utf-8'))
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from iter_results(f)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def report_mentions_drug(report, drug):
+    drug = drug.upper()
+    for entry in report.get('patient', {}).get('drug', []):
+        names = [entry.get('medicinalproduct') or '']
+        names += entry.get('openfda', {}).get('brand_name', [])
+        names += entry.get('openfda', {}).get('generic_name', [])
+        if any(drug in name.upper() for name in names):
+            return True
+    return False
+
+
+# One row per (reaction, drug) pair of the report, in the OPENFDA_COLUMNS schema
+def flatten_report(report):
+    patient = report.get('patient', {})
+    source = report.get('primarysource') or {}
+    report_fields = {
+        'safetyreportid': _int_or_none(report.get('safetyreportid')),
+        'serious': _int_or_none(report.get('serious')),
+        'seriousnessdeath': _int_or_none(report.get('seriousnessdeath')) or 0,
+        'receivedate': _int_or_none(report.get('receivedate')),
+        'reportercountry': source.get('reportercountry'),
+        'reporterqualification': _int_or_none(source.get('qualification')),
+        'patient_age': patient.get('patientonsetage'),
+        'patient_age_unit': AGE_UNIT_CODES.get(str(patient.get('patientonsetageunit'))),
+        'patient_sex': _int_or_none(patient.get('patientsex')),
+    }
+
+    reactions = [r.get('reactionmeddrapt') for r in patient.get('reaction', [])] or [None]
+    drugs = patient.get('drug', []) or [{}]
+    rows = []
+    for reaction in reactions:
+        for drug in drugs:
+            rows.append(dict(
+                report_fields,
+                reaction_meddra=reaction,
+                drug_name=drug.get('medicinalproduct'),
+                drug_characterization=_int_or_none(drug.get('drugcharacterization')),
+                drug_admin_route=drug.get('drugadministrationroute'),
+                drug_indication=drug.get('drugindication'),
+            ))
+    return rows
+
+
+def stored_report_ids(output_path):
+    if not os.path.exists(output_path):
+        return set()
+    if os.path.isdir(output_path) or output_path.endswith('.parquet'):
+        ids = pd.read_parquet(output_path, columns=['safetyreportid'])['safetyreportid']
+    else:
+        ids = pd.read_csv(output_path, usecols=['safetyreportid'], encoding='utf-8-sig')['safetyreportid']
+    return set(ids.dropna().astype('int64'))
+
+
+# Flattened rows with the loader's compact dtypes
+def typed_frame(rows):
+    df = pd.DataFrame(rows, columns=OPENFDA_COLUMNS)
+    for column in ['reporterqualification', 'drug_admin_route', 'patient_age']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    return convert_openfda_types(df.astype(OPENFDA_DTYPES))
+
+
+# Columns whose stored type differs from the batch about to be appended (category columns aside,
+# since their index width follows the number of categories in each file)
+def mismatched_columns(output_path, df):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    stored = ds.dataset(output_path, format='parquet', partitioning='hive').schema
+    batch = pa.Schema.from_pandas(df, preserve_index=False)
+    return [field.name for field in batch
+            if field.name in stored.names and not pa.types.is_dictionary(field.type)
+            and stored.field(field.name).type != field.type]
+
+
+def append_rows(rows, output_path):
+    if os.path.isdir(output_path) or output_path.endswith('.parquet'):
+        df = typed_frame(rows)
+        # Files with a different type for the same column make the whole dataset unreadable
+        if os.path.exists(output_path):
+            mismatched = mismatched_columns(output_path, df)
+            if mismatched:
+                raise ValueError(f"{output_path} stores {', '.join(mismatched)} with other types than this "
+                                 f"version writes; rerun convert_data.py before ingesting")
+        # New files inside the existing year partitions (same layout as convert_data.py)
+        write_partitioned_parquet(df, output_path, append=True,
+                                  basename_template=f"ingest-{uuid.uuid4().hex}-{{i}}.parquet")
+    else:
+        write_header = not os.path.exists(output_path)
+        df = pd.DataFrame(rows, columns=OPENFDA_COLUMNS).astype({c: 'Int64' for c in CSV_INTEGER_COLUMNS})
+        df.to_csv(output_path, mode='a', header=write_header, index=False)
+
+
+# Append the new reports from the given bulk files; returns (new reports, rows written).
+# If the saved Trends counts or report sketches match the current output file, each batch is added
+# to them as well.
+def ingest(paths, output_path=OZEMPIC_DATA_PATH, drug='OZEMPIC', batch_reports=BATCH_REPORTS,
+           counts_path=TREND_COUNTS_PATH, sketches_path=SKETCHES_PATH):
+    seen = stored_report_ids(output_path)
+    period_counts = load_synced_counts(output_path, counts_path)
+    sketches = load_synced_sketches(output_path, sketches_path)
+    new_reports = 0
+    written = 0
+    batch = []
+    batch_count = 0
+
+    def flush(batch):
+        append_rows(batch, output_path)
+        if period_counts is not None or sketches is not None:
+            tables = ReportTables(prepare_openfda_data(typed_frame(batch)))
+            if period_counts is not None:
+                period_counts.add(tables)
+            if sketches is not None:
+                sketches.add(tables)
+
+    for path in paths:
+        for report in iter_reports(path):
+            report_id = _int_or_none(report.get('safetyreportid'))
+            if report_id is None or report_id in seen:
+                continue
+            if drug and not report_mentions_drug(report, drug):
+                continue
+            seen.add(report_id)
+            batch.extend(flatten_report(report))
+            batch_count += 1
+            if batch_count >= batch_reports:
+                flush(batch)
+                new_reports += batch_count
+                written += len(batch)
+                batch, batch_count = [], 0
+
+    if batch:
+        flush(batch)
+        new_reports += batch_count
+        written += len(batch)
+    if period_counts is not None:
+        period_counts.save(counts_path, file_signature(output_path))
+    if sketches is not None:
+        sketches.save(sketches_path, file_signature(output_path))
+    return new_reports, written
+
+
+# Sample bulk files with missing fields (report 3 has no receivedate), ingested one at a time so the
+# output is created and then appended to
+CHECK_FILES = [
+    [{'safetyreportid': '1', 'serious': '1', 'receivedate': '20190101',
+      'patient': {'patientonsetage': '2.5', 'patientonsetageunit': '801', 'patientsex': '2',
+                  'reaction': [{'reactionmeddrapt': 'Nausea'}], 'drug': [{'medicinalproduct': 'OZEMPIC'}]}}],
+    [{'safetyreportid': '2', 'receivedate': '20200615',
+      'patient': {'patientonsetage': '40', 'reaction': [{'reactionmeddrapt': 'Vomiting'}],
+                  'drug': [{'medicinalproduct': 'OZEMPIC', 'drugcharacterization': '1'}]}},
+     {'safetyreportid': '3',
+      'patient': {'patientonsetage': '55', 'reaction': [{'reactionmeddrapt': 'Nausea'}],
+                  'drug': [{'medicinalproduct': 'OZEMPIC'}]}}],
+]
+
+
+# Ingest CHECK_FILES into a new CSV and a new Parquet dataset and load them back with the app's loader;
+# returns the problems found
+def check_round_trip():
+    import tempfile
+
+    reports = [report for results in CHECK_FILES for report in results]
+    expected = pd.Series(pd.to_datetime([r.get('receivedate') for r in reports], format='%Y%m%d'), name='receivedate')
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, results in enumerate(CHECK_FILES):
+            paths.append(os.path.join(directory, f'reports-{i}.json'))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                json.dump({'meta': {}, 'results': results}, f)
+
+        for output in ['check.csv', 'check.parquet']:
+            output_path = os.path.join(directory, output)
+            for path in paths:
+                ingest([path], output_path, counts_path=os.path.join(directory, 'counts.npz'),
+                       sketches_path=os.path.join(directory, 'sketches.npz'))
+            if output.endswith('.csv'):
+                raw = pd.read_csv(output_path, dtype='string', usecols=CSV_INTEGER_COLUMNS)
+                floats = [c for c in CSV_INTEGER_COLUMNS if raw[c].str.contains('.', regex=False).any()]
+                if floats:
+                    problems.append(f"{output}: {', '.join(floats)} written as floats")
+            df = prepare_openfda_data(read_openfda_file(output_path)).sort_values('safetyreportid')
+            received = df['receivedate'].reset_index(drop=True).astype(expected.dtype)
+            if len(df) != len(reports):
+                problems.append(f"{output}: {len(df)} of {len(reports)} reports loaded back")
+            elif not received.equals(expected):
+                problems.append(f"{output}: receivedate loaded back as {list(received)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new reports from openFDA drug-event bulk files.")
+    parser.add_argument('files', nargs='*', help="drug-event .json.zip (or .json) files")
+    parser.add_argument('-o', '--output', default=OZEMPIC_DATA_PATH,
+                        help="CSV file or partitioned Parquet directory to append to")
+    parser.add_argument('--drug', default='OZEMPIC',
+                        help="only keep reports mentioning this drug (empty string keeps every report)")
+    parser.add_argument('--trend-counts', default=TREND_COUNTS_PATH,
+                        help="saved Trends tab counts to update alongside the data (skipped if out of date)")
+    parser.add_argument('--sketches', default=SKETCHES_PATH,
+                        help="saved report sketches to update alongside the data (skipped if out of date)")
+    parser.add_argument('--check', action='store_true',
+                        help="check that ingested reports load back intact, instead of ingesting files")
+    args = parser.parse_args()
+
+    if args.check:
+        problems = check_round_trip()
+        for problem in problems:
+            print(problem)
+        print("Round trip failed" if problems else "Round trip OK (CSV and Parquet)")
+        sys.exit(1 if problems else 0)
+    if not args.files:
+        parser.error("no drug-event files given")
+
+    new_reports, written = ingest(args.files, args.output, drug=args.drug, counts_path=args.trend_counts,
+                                  sketches_path=args.sketches)
+    print(f"Appended {new_reports} new reports ({written} rows) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
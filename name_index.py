@@ -0,0 +1,127 @@
+# Year and name index for the name-analysis helpers in "app copy.py"
+#
+# The names frame (name, sex, year, count, ...) is ordered once by (year, sex, count descending)
+# and once by (name, year, sex), with offset tables marking where each year, (year, sex) pair and
+# name starts. A year's top names, a per-year summary or a name's trend is then a slice of one
+# ordering instead of a scan over the whole frame. One-hit wonders (a name and sex given in only one
+# year) are found for all years at once.
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from shared_store import freeze
+
+
+class NameIndex:
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        years = self.df["year"].to_numpy().astype(np.int64)
+        sex_codes, self.sexes = pd.factorize(self.df["sex"], sort=True)
+        name_codes, self.names = pd.factorize(self.df["name"], sort=True)
+        n_sexes = max(len(self.sexes), 1)
+
+        # Rows by (year, sex, count descending); ties keep the frame's order
+        self.year_order = np.lexsort((-self.df["count"].to_numpy(), sex_codes, years))
+        ordered_years = years[self.year_order]
+        self.years, starts = np.unique(ordered_years, return_index=True)
+        self.year_offsets = np.append(starts, len(self.df))
+        year_sex = ordered_years * n_sexes + sex_codes[self.year_order]
+        self.year_sex_keys, starts = np.unique(year_sex, return_index=True)
+        self.year_sex_offsets = np.append(starts, len(self.df))
+
+        # Rows by (name, year, sex); the names are sorted, so name i's rows start at the i-th offset
+        self.name_order = np.lexsort((sex_codes, years, name_codes))
+        self.name_offsets = np.concatenate([[0], np.cumsum(np.bincount(name_codes, minlength=len(self.names)))])
+
+        # One-hit wonders: count the distinct years of each (name, sex) in one sorted pass
+        group = name_codes * n_sexes + sex_codes
+        ordered = np.lexsort((years, group))
+        group_sorted, years_sorted = group[ordered], years[ordered]
+        first = np.ones(len(group), dtype=bool)
+        first[1:] = (group_sorted[1:] != group_sorted[:-1]) | (years_sorted[1:] != years_sorted[:-1])
+        n_years = np.bincount(group_sorted[first], minlength=len(self.names) * n_sexes)
+        one_hit = n_years[group] == 1
+        # (kept in year order, with their own year offsets)
+        self.one_hit_order = self.year_order[one_hit[self.year_order]]
+        self.one_hit_offsets = np.searchsorted(years[self.one_hit_order], self.years, side="left")
+        self.one_hit_offsets = np.append(self.one_hit_offsets, len(self.one_hit_order))
+        self._n_sexes = n_sexes
+
+    def _year_position(self, year):
+        i = np.searchsorted(self.years, year)
+        if i == len(self.years) or self.years[i] != year:
+            return None
+        return i
+
+    # All rows for a year, ordered by sex then count (largest first)
+    def year_rows(self, year):
+        i = self._year_position(year)
+        if i is None:
+            return self.df.iloc[:0]
+        return self.df.iloc[self.year_order[self.year_offsets[i]:self.year_offsets[i + 1]]]
+
+    # The n most given names of one sex in a year (all of them when n is None)
+    def top_rows(self, year, sex, n=None):
+        sex_code = self.sexes.get_indexer([sex])[0]
+        key = int(year) * self._n_sexes + sex_code
+        i = np.searchsorted(self.year_sex_keys, key)
+        if sex_code < 0 or i == len(self.year_sex_keys) or self.year_sex_keys[i] != key:
+            return self.df.iloc[:0]
+        start, stop = self.year_sex_offsets[i], self.year_sex_offsets[i + 1]
+        if n is not None:
+            stop = min(stop, start + n)
+        return self.df.iloc[self.year_order[start:stop]]
+
+    # All rows for a name, ordered by year then sex
+    def name_rows(self, name):
+        i = self.names.get_indexer([name])[0]
+        if i < 0:
+            return self.df.iloc[:0]
+        return self.df.iloc[self.name_order[self.name_offsets[i]:self.name_offsets[i + 1]]]
+
+    # One-hit wonder rows for a year (all years when year is None)
+    def one_hit_wonder_rows(self, year=None):
+        if year is None:
+            return self.df.iloc[self.one_hit_order]
+        i = self._year_position(year)
+        if i is None:
+            return self.df.iloc[:0]
+        return self.df.iloc[self.one_hit_order[self.one_hit_offsets[i]:self.one_hit_offsets[i + 1]]]
+
+
+# The same lookups as NameIndex, answered by scanning a plain names frame (rows in frame order,
+# except top_rows). Indexing costs several sorts of the whole frame, so it isn't built per call.
+class NameScan:
+    def __init__(self, df):
+        self.df = df
+
+    def year_rows(self, year):
+        return self.df[self.df["year"] == year]
+
+    def top_rows(self, year, sex, n=None):
+        rows = self.year_rows(year)
+        rows = rows[rows["sex"] == sex].sort_values("count", ascending=False, kind="stable")
+        return rows if n is None else rows.head(n)
+
+    def name_rows(self, name):
+        return self.df[self.df["name"] == name]
+
+    def one_hit_wonder_rows(self, year=None):
+        # (for one year, only the names given that year need their years counted)
+        df = self.df if year is None else self.df[self.df["name"].isin(self.year_rows(year)["name"])]
+        one_hit = df.groupby(["name", "sex"])["year"].transform("nunique") == 1
+        if year is not None:
+            one_hit &= df["year"] == year
+        return df[one_hit]
+
+
+# The helpers accept a NameIndex (from build_name_index, built once per dataset) or the names frame
+# itself, which is scanned instead
+def as_name_index(names):
+    return names if isinstance(names, NameIndex) else NameScan(names)
+
+
+# data_key identifies the loaded names data, so the frame itself isn't hashed
+@tracked_cache_resource(show_spinner="Indexing names...", max_entries=4)
+def build_name_index(_df, data_key):
+    return freeze(NameIndex(_df))
@@ -0,0 +1,339 @@
+# Query backends behind the sidebar filters, the Visualizations charts and the Data Explorer
+#
+# PandasBackend answers from the in-memory frames and the precomputed filter engine / count cube.
+# DuckDBBackend pushes the same queries down as SQL over the CSV or partitioned Parquet files
+# (filters become WHERE clauses, explorer pages become ORDER BY ... LIMIT/OFFSET), so extracts
+# larger than RAM can be served. DuckDB is optional (pip install duckdb); without it the app
+# falls back to pandas.
+#
+# Choose the backend with the OZEMPIC_QUERY_BACKEND environment variable ("pandas" or "duckdb").
+import math
+import os
+import threading
+
+import pandas as pd
+
+from aggregates import age_band_counts, build_reaction_cube
+from data_loader import (AGE_UNIT_CODES, AGE_UNIT_YEARS, CHART_COLUMNS, DERIVED_COLUMNS, MAX_AGE, file_signature,
+                         load_openfda_data, openfda_file_columns)
+from diagnostics import tracked_cache_resource
+from explorer import frame_page
+from export import EXPORT_CHUNK_ROWS, export_chunks, export_rows
+from filters import build_filter_engine, selected_sex_code
+from report_model import build_report_tables
+from signals import build_signals, disproportionality
+from trends import PeriodCounts, build_period_counts, load_synced_counts
+
+
+QUERY_BACKENDS = ["pandas", "duckdb"]
+
+DEFAULT_QUERY_BACKEND = os.environ.get("OZEMPIC_QUERY_BACKEND", "pandas")
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def __init__(self, path):
+        self.path = path
+        self.data_key = (path, file_signature(path))
+
+        # The sidebar and Visualizations tab only need a few columns; the Data Explorer's full frame is only
+        # loaded once that tab asks for a page or a download
+        self.chart_data = load_openfda_data(path, columns=CHART_COLUMNS)
+        self.filter_engine = build_filter_engine(self.chart_data, self.data_key)
+        # (the cube is built from the report-level tables, so the charts count reports rather than flattened rows)
+        self.report_tables = build_report_tables(self.chart_data, self.data_key)
+        self.reaction_cube = build_reaction_cube(self.report_tables, self.data_key)
+
+    # Both frames come from the same file with the same age filter, so their row positions line up
+    # (the derived columns are left out of the explorer and the downloads)
+    def explorer_data(self):
+        return load_openfda_data(self.path).drop(columns=DERIVED_COLUMNS)
+
+    def age_bounds(self):
+        return self.filter_engine.age_bounds() or (0, 120)
+
+    def top_reactions(self, age_range, genders, n=10):
+        return self.reaction_cube.reaction_counts(age_range, genders, n=n)
+
+    def severity_counts(self, age_range, genders):
+        return self.reaction_cube.severity_counts(age_range, genders)
+
+    def age_distribution(self, age_range, genders):
+        return self.reaction_cube.age_distribution(age_range, genders)
+
+    def columns(self):
+        return list(self.explorer_data().columns)
+
+    # Every distinct reaction_meddra term, sorted
+    def reaction_terms(self):
+        return list(self.report_tables.reactions.terms)
+
+    def period_counts(self):
+        return build_period_counts(self.report_tables, self.data_key)
+
+    def signals(self):
+        return build_signals(self.report_tables, self.data_key)
+
+    def count(self, age_range, genders, severity="All"):
+        return len(self.filter_engine.select(age_range, genders, severity))
+
+    def page(self, age_range, genders, severity, start, stop, sort_column=None, ascending=True):
+        rows = self.filter_engine.select(age_range, genders, severity)
+        return frame_page(self.explorer_data(), rows, self.data_key, start, stop, sort_column, ascending)
+
+    # A page of the rows behind the charts, with only the chart columns (doesn't need the full frame)
+    def chart_page(self, age_range, genders, start, stop):
+        rows = self.filter_engine.select(age_range, genders)
+        return frame_page(self.chart_data.drop(columns=DERIVED_COLUMNS), rows, self.data_key, start, stop)
+
+    def export(self, age_range, genders, severity, export_format):
+        rows = self.filter_engine.select(age_range, genders, severity)
+        return export_rows(self.explorer_data(), rows, export_format)
+
+
+class DuckDBBackend:
+    name = "duckdb"
+
+    def __init__(self, path):
+        import duckdb
+
+        self.path = path
+        self.data_key = (path, file_signature(path))
+        self._connection = duckdb.connect()
+        self._lock = threading.Lock()
+
+        # The CSV stores receivedate as YYYYMMDD numbers; the columnar files already hold timestamps
+        receivedate = "receivedate"
+        if os.path.isdir(path):
+            source = f"read_parquet('{_sql_path(os.path.join(path, '**', '*.parquet'))}', hive_partitioning = true)"
+        elif path.endswith('.parquet'):
+            source = f"read_parquet('{_sql_path(path)}')"
+        elif path.endswith('.feather'):
+            # (DuckDB has no Feather reader, and Arrow tables registered on the connection aren't visible to
+            # the per-query cursors)
+            raise ValueError(f"The DuckDB backend can't read Feather files ({path}); convert the CSV to "
+                             f"partitioned Parquet with convert_data.py or use OZEMPIC_QUERY_BACKEND=pandas")
+        else:
+            source = f"read_csv('{_sql_path(path)}', header = true, types = {{'drug_admin_route': 'VARCHAR'}})"
+            # (through integers, so YYYYMMDD values stored as floats next to missing ones still parse)
+            receivedate = "TRY_STRPTIME(CAST(TRY_CAST(TRY_CAST(receivedate AS DOUBLE) AS BIGINT) AS VARCHAR), '%Y%m%d')"
+
+        # Same preprocessing as data_loader: ages converted to years (files without patient_age_unit hold
+        # years), realistic range only, binned by whole year, parsed receivedate
+        factor = _age_unit_factor_sql() if 'patient_age_unit' in openfda_file_columns(path) else "1.0"
+        self._connection.execute(f"""
+            CREATE VIEW openfda AS
+            SELECT * EXCLUDE (age_years) REPLACE (TRY_CAST(patient_age AS FLOAT) AS patient_age,
+                                                  {receivedate} AS receivedate),
+                   CAST(FLOOR(age_years) AS UTINYINT) AS patient_age_bin
+            FROM (SELECT *, TRY_CAST(patient_age AS DOUBLE) * {factor} AS age_years FROM {source})
+            WHERE age_years BETWEEN 0 AND {MAX_AGE}
+        """)
+        self._columns = [c for c in self._query("SELECT * FROM openfda LIMIT 0").columns
+                         if c != 'receivedate_year' and c not in DERIVED_COLUMNS]
+
+    # Each query runs on its own cursor, since sessions share the backend from different threads
+    def _query(self, sql, params=None):
+        with self._lock:
+            cursor = self._connection.cursor()
+        return cursor.execute(sql, params or []).df()
+
+    def _where(self, age_range, genders, severity="All"):
+        clauses = ["patient_age_bin BETWEEN ? AND ?"]
+        params = [math.ceil(age_range[0]), math.floor(age_range[1])]
+        code = selected_sex_code(genders)
+        if code is not None:
+            clauses.append("patient_sex = ?")
+            params.append(code)
+        if severity == "Serious":
+            clauses.append("serious = 1")
+        elif severity == "Non-Serious":
+            clauses.append("serious <> 1")
+        return " AND ".join(clauses), params
+
+    def age_bounds(self):
+        bounds = self._query("SELECT MIN(patient_age_bin), MAX(patient_age_bin) FROM openfda").iloc[0]
+        if bounds.isna().any():
+            return (0, 120)
+        return (int(bounds.iloc[0]), int(bounds.iloc[1]))
+
+    # Reports per reaction (each reaction counted once per report), largest first
+    def top_reactions(self, age_range, genders, n=10):
+        where, params = self._where(age_range, genders)
+        counts = self._query(f"""
+            SELECT reaction_meddra, COUNT(DISTINCT safetyreportid) AS count
+            FROM openfda
+            WHERE {where} AND reaction_meddra IS NOT NULL
+            GROUP BY reaction_meddra
+            ORDER BY count DESC, reaction_meddra
+            LIMIT ?
+        """, params + [n])
+        return counts.set_index("reaction_meddra")["count"]
+
+    # Serious (1) and non-serious (2) report counts
+    def severity_counts(self, age_range, genders):
+        where, params = self._where(age_range, genders)
+        counts = self._query(f"""
+            SELECT COUNT(DISTINCT safetyreportid) FILTER (WHERE serious = 1) AS serious,
+                   COUNT(DISTINCT safetyreportid) FILTER (WHERE serious <> 1) AS non_serious
+            FROM openfda
+            WHERE {where}
+        """, params).iloc[0]
+        return pd.Series([int(counts["serious"]), int(counts["non_serious"])],
+                         index=pd.Index([1, 2], name="serious"), name="count")
+
+    # Report counts per whole-year age, summed into the same bands as the cube
+    def age_distribution(self, age_range, genders):
+        where, params = self._where(age_range, genders)
+        counts = self._query(f"""
+            SELECT patient_age_bin, COUNT(DISTINCT safetyreportid) AS count
+            FROM openfda
+            WHERE {where}
+            GROUP BY patient_age_bin
+            ORDER BY patient_age_bin
+        """, params)
+        return age_band_counts(counts["patient_age_bin"], counts["count"])
+
+    def columns(self):
+        return list(self._columns)
+
+    # Every distinct reaction_meddra term, sorted
+    def reaction_terms(self):
+        return _duckdb_reaction_terms(self, self.data_key)
+
+    def period_counts(self):
+        return _duckdb_period_counts(self, self.data_key)
+
+    def signals(self):
+        return _duckdb_signals(self, self.data_key)
+
+    # The co-occurrence counts and margins for signals.disproportionality, computed inside DuckDB
+    def _group_signal_counts(self):
+        pairs = self._query("""
+            WITH report_drugs AS (
+                SELECT DISTINCT safetyreportid, drug_name FROM openfda WHERE drug_name IS NOT NULL
+            ), report_reactions AS (
+                SELECT DISTINCT safetyreportid, reaction_meddra FROM openfda WHERE reaction_meddra IS NOT NULL
+            )
+            SELECT drug_name AS drug, reaction_meddra AS reaction, COUNT(*) AS a
+            FROM report_drugs JOIN report_reactions USING (safetyreportid)
+            GROUP BY drug_name, reaction_meddra
+        """)
+        drug_totals = self._query("""
+            SELECT drug_name, COUNT(DISTINCT safetyreportid) AS reports FROM openfda
+            WHERE drug_name IS NOT NULL GROUP BY drug_name ORDER BY drug_name
+        """).set_index("drug_name")["reports"]
+        reaction_totals = self._query("""
+            SELECT reaction_meddra, COUNT(DISTINCT safetyreportid) AS reports FROM openfda
+            WHERE reaction_meddra IS NOT NULL GROUP BY reaction_meddra ORDER BY reaction_meddra
+        """).set_index("reaction_meddra")["reports"]
+        n_reports = int(self._query("SELECT COUNT(DISTINCT safetyreportid) FROM openfda").iloc[0, 0])
+
+        pairs["drug"] = pd.Categorical(pairs["drug"], categories=drug_totals.index)
+        pairs["reaction"] = pd.Categorical(pairs["reaction"], categories=reaction_totals.index)
+        return pairs, drug_totals, reaction_totals, n_reports
+
+    # Monthly report and (report, reaction) counts grouped inside DuckDB
+    def _group_period_counts(self):
+        month = "YEAR(receivedate) * 12 + MONTH(receivedate) - 1"
+        reports = self._query(f"""
+            SELECT {month} AS month, COUNT(DISTINCT safetyreportid) AS reports
+            FROM openfda WHERE receivedate IS NOT NULL GROUP BY month
+        """)
+        reactions = self._query(f"""
+            SELECT {month} AS month, reaction_meddra, COUNT(DISTINCT safetyreportid) AS reports
+            FROM openfda WHERE receivedate IS NOT NULL AND reaction_meddra IS NOT NULL
+            GROUP BY month, reaction_meddra
+        """)
+        return PeriodCounts.from_aggregates(reports["month"], reports["reports"], reactions["month"],
+                                            reactions["reaction_meddra"], reactions["reports"])
+
+    def count(self, age_range, genders, severity="All"):
+        where, params = self._where(age_range, genders, severity)
+        return int(self._query(f"SELECT COUNT(*) FROM openfda WHERE {where}", params).iloc[0, 0])
+
+    def _select(self, age_range, genders, severity, sort_column=None, ascending=True, columns=None):
+        where, params = self._where(age_range, genders, severity)
+        columns = ", ".join(_sql_identifier(c) for c in columns or self._columns)
+        order = ""
+        if sort_column is not None:
+            order = f"ORDER BY {_sql_identifier(sort_column)} {'ASC' if ascending else 'DESC'} NULLS LAST"
+        return f"SELECT {columns} FROM openfda WHERE {where} {order}", params
+
+    def page(self, age_range, genders, severity, start, stop, sort_column=None, ascending=True):
+        sql, params = self._select(age_range, genders, severity, sort_column, ascending)
+        return self._query(f"{sql} LIMIT ? OFFSET ?", params + [max(stop - start, 0), start])
+
+    def chart_page(self, age_range, genders, start, stop):
+        columns = [c for c in CHART_COLUMNS if c in self._columns]
+        sql, params = self._select(age_range, genders, "All", columns=columns)
+        return self._query(f"{sql} LIMIT ? OFFSET ?", params + [max(stop - start, 0), start])
+
+    # Streams the result in record batches instead of materializing the whole filtered table
+    def export(self, age_range, genders, severity, export_format):
+        sql, params = self._select(age_range, genders, severity)
+        with self._lock:
+            cursor = self._connection.cursor()
+        reader = cursor.execute(sql, params).fetch_record_batch(EXPORT_CHUNK_ROWS)
+        empty = reader.schema.empty_table().to_pandas()
+        chunks = (batch.to_pandas() for batch in reader)
+        return export_chunks(empty, chunks, export_format)
+
+
+# Years per patient_age_unit (names or openFDA codes) as a SQL CASE expression; NULL units are years
+def _age_unit_factor_sql():
+    cases = [f"WHEN '{code}' THEN {AGE_UNIT_YEARS[name]!r}" for code, name in AGE_UNIT_CODES.items()]
+    cases += [f"WHEN '{name}' THEN {factor!r}" for name, factor in AGE_UNIT_YEARS.items()]
+    return f"(CASE COALESCE(CAST(patient_age_unit AS VARCHAR), 'Years') {' '.join(cases)} END)"
+
+
+def _sql_path(path):
+    return path.replace("'", "''")
+
+
+def _sql_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def duckdb_available():
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# The backend for the requested name, falling back to pandas when DuckDB isn't installed
+def query_backend(path, name=DEFAULT_QUERY_BACKEND):
+    if name == "duckdb" and duckdb_available():
+        return _duckdb_backend(path, file_signature(path))
+    return _pandas_backend(path, file_signature(path))
+
+
+@tracked_cache_resource(max_entries=4)
+def _duckdb_backend(path, signature):
+    return DuckDBBackend(path)
+
+
+@tracked_cache_resource(max_entries=4)
+def _duckdb_period_counts(_backend, data_key):
+    counts = load_synced_counts(data_key[0])
+    return counts if counts is not None else _backend._group_period_counts()
+
+
+@tracked_cache_resource(max_entries=4)
+def _duckdb_reaction_terms(_backend, data_key):
+    return _backend._query("""
+        SELECT DISTINCT reaction_meddra FROM openfda WHERE reaction_meddra IS NOT NULL ORDER BY reaction_meddra
+    """)["reaction_meddra"].tolist()
+
+
+@tracked_cache_resource(show_spinner="Computing disproportionality statistics...", max_entries=4)
+def _duckdb_signals(_backend, data_key):
+    return disproportionality(*_backend._group_signal_counts())
+
+
+@tracked_cache_resource(max_entries=4)
+def _pandas_backend(path, signature):
+    return PandasBackend(path)
@@ -0,0 +1,80 @@
+# Normalized, report-level view of the flattened openFDA data
+#
+# The CSV repeats the report-level fields (serious, patient_age, patient_sex, receivedate,
+# reportercountry) on every (reaction, drug) row. Here they are stored once per report, and
+# reactions and drugs become deduplicated (report, term) pairs of integer codes, so report-level
+# counts count each report once and reaction counts count each reaction once per report.
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from shared_store import freeze
+
+
+REPORT_COLUMNS = ['safetyreportid', 'serious', 'seriousnessdeath', 'receivedate', 'reportercountry',
+                  'patient_age', 'patient_age_unit', 'patient_age_bin', 'patient_sex']
+
+
+# Deduplicated (report, term) pairs for one categorical column of the flat frame
+class ReportTerms:
+    def __init__(self, row_reports, column, n_reports):
+        values = column.astype('category')
+        self.terms = values.cat.categories
+        codes = values.cat.codes.to_numpy().astype(np.int64)
+        keep = codes >= 0
+
+        n_terms = max(len(self.terms), 1)
+        pairs = np.unique(row_reports[keep].astype(np.int64) * n_terms + codes[keep])
+        self.report = (pairs // n_terms).astype(np.int32)
+        self.term = (pairs % n_terms).astype(np.int32)
+        self.n_reports = n_reports
+
+    def __len__(self):
+        return len(self.report)
+
+    # Number of reports mentioning each term (optionally only reports where report_mask is True)
+    def counts(self, report_mask=None):
+        term = self.term if report_mask is None else self.term[report_mask[self.report]]
+        totals = np.bincount(term, minlength=len(self.terms))
+        return pd.Series(totals, index=pd.Index(self.terms, name='term'), name='reports')
+
+
+class ReportTables:
+    def __init__(self, df):
+        # Report index = position of safetyreportid in the sorted array of distinct ids
+        ids = df['safetyreportid'].to_numpy()
+        report_ids, first_rows, row_reports = np.unique(ids, return_index=True, return_inverse=True)
+        self.row_reports = row_reports.astype(np.int32)
+
+        columns = [c for c in REPORT_COLUMNS if c in df.columns]
+        self.reports = df[columns].iloc[first_rows].reset_index(drop=True)
+        self.n_reports = len(report_ids)
+
+        self.reactions = ReportTerms(self.row_reports, df['reaction_meddra'], self.n_reports)
+        self.drugs = (ReportTerms(self.row_reports, df['drug_name'], self.n_reports)
+                      if 'drug_name' in df.columns else None)
+
+    # Reports that have at least one of the given flat-frame rows
+    def report_mask(self, rows):
+        mask = np.zeros(self.n_reports, dtype=bool)
+        mask[self.row_reports[rows]] = True
+        return mask
+
+    # Serious (1) and non-serious (anything else) report counts
+    def severity_counts(self, report_mask=None):
+        serious = self.reports['serious'].to_numpy()
+        if report_mask is not None:
+            serious = serious[report_mask]
+        n_serious = int(np.count_nonzero(serious == 1))
+        return pd.Series([n_serious, len(serious) - n_serious], index=pd.Index([1, 2], name='serious'),
+                         name='reports')
+
+
+# data_key identifies the loaded dataset (path and file signature), so the frame itself isn't hashed
+@tracked_cache_resource(max_entries=4)
+def build_report_tables(_df, data_key):
+    tables = freeze(ReportTables(_df))
+    for terms in (tables.reactions, tables.drugs):
+        if terms is not None:
+            freeze(terms)
+    return tables
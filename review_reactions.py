@@ -0,0 +1,137 @@
+# Which openFDA reactions (reaction_meddra terms) each Drugs.com review mentions
+#
+# All reaction terms are compiled into one Aho-Corasick automaton over word ids of the review index
+# (search_index.ReviewIndex), so every review is scanned once no matter how many terms there are,
+# and matches always start and end on word boundaries. Only runs of words that occur in some term
+# are fed through the automaton; any other word sends it back to the root anyway.
+#
+# The result is a sparse review x reaction matrix, stored as deduplicated (review, reaction)
+# coordinate arrays like report_model.ReportTerms.
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from search_index import tokenize
+from shared_store import freeze
+
+
+# MedDRA uses British spellings; reviews are mostly written with American ones
+SPELLING_VARIANTS = [("ae", "e"), ("oe", "e")]
+
+
+# The term's token sequence plus American-spelling variants ("Diarrhoea" also matches "diarrhea")
+def term_variants(term):
+    tokens = tokenize(str(term).replace("^", "'"))
+    variants = {tuple(tokens)}
+    for old, new in SPELLING_VARIANTS:
+        variants |= {tuple(token.replace(old, new) for token in variant) for variant in variants}
+    variants |= {tuple(token[:-3] + "or" if len(token) > 4 and token.endswith("our") else token
+                       for token in variant) for variant in variants}
+    return [variant for variant in variants if variant]
+
+
+class ReactionAutomaton:
+    # patterns: (token id sequence, reaction id) pairs
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.output = [[]]
+        for tokens, reaction in patterns:
+            state = 0
+            for token in tokens:
+                if token not in self.goto[state]:
+                    self.goto.append({})
+                    self.output.append([])
+                    self.goto[state][token] = len(self.goto) - 1
+                state = self.goto[state][token]
+            self.output[state].append(reaction)
+
+        # Failure links in breadth-first order; each state also reports the matches of its failure state
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    # Reaction ids of every match in a sequence of token ids
+    def matches(self, tokens):
+        state = 0
+        found = []
+        for token in tokens:
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            found.extend(self.output[state])
+        return found
+
+
+class ReviewReactions:
+    def __init__(self, index, reactions):
+        self.reactions = pd.Index(reactions, name="reaction_meddra")
+        self.n_reviews = index.n_docs
+
+        # Patterns in the review vocabulary; a term with a word no review uses can never match
+        term_ids = {term: i for i, term in enumerate(index.terms)}
+        patterns = []
+        for reaction, term in enumerate(self.reactions):
+            for variant in term_variants(term):
+                if all(token in term_ids for token in variant):
+                    patterns.append(([term_ids[token] for token in variant], reaction))
+        automaton = ReactionAutomaton(patterns)
+
+        # Runs of consecutive pattern words within a review
+        relevant = np.zeros(len(index.terms), dtype=bool)
+        relevant[[token for tokens, _ in patterns for token in tokens]] = True
+        positions = np.flatnonzero(relevant[index.doc_tokens])
+        docs = np.searchsorted(index.doc_offsets, positions, side="right") - 1
+        breaks = np.flatnonzero((np.diff(positions) != 1) | (np.diff(docs) != 0)) + 1
+        run_starts = np.concatenate([[0], breaks]) if len(positions) else np.empty(0, dtype=np.int64)
+        run_stops = np.concatenate([breaks, [len(positions)]]) if len(positions) else np.empty(0, dtype=np.int64)
+
+        review, reaction = [], []
+        for start, stop in zip(run_starts, run_stops):
+            found = automaton.matches(index.doc_tokens[positions[start]:positions[stop - 1] + 1].tolist())
+            review.extend([docs[start]] * len(found))
+            reaction.extend(found)
+
+        n_reactions = max(len(self.reactions), 1)
+        pairs = np.unique(np.array(review, dtype=np.int64) * n_reactions + np.array(reaction, dtype=np.int64))
+        self.review = (pairs // n_reactions).astype(np.int32)
+        self.reaction = (pairs % n_reactions).astype(np.int32)
+
+    def __len__(self):
+        return len(self.review)
+
+    # Number of reviews mentioning each reaction (optionally only reviews where review_mask is True)
+    def counts(self, review_mask=None):
+        reaction = self.reaction if review_mask is None else self.reaction[review_mask[self.review]]
+        return pd.Series(np.bincount(reaction, minlength=len(self.reactions)), index=self.reactions, name="reviews")
+
+    # Reviews mentioning each reaction, split by the reviews' sentiment labels (one column per label)
+    def label_counts(self, labels):
+        labels = pd.Categorical(labels)
+        n_labels = len(labels.categories)
+        codes = labels.codes[self.review].astype(np.int64)
+        keep = codes >= 0
+        totals = np.bincount(self.reaction[keep].astype(np.int64) * n_labels + codes[keep],
+                             minlength=len(self.reactions) * n_labels)
+        return pd.DataFrame(totals.reshape(len(self.reactions), n_labels), index=self.reactions,
+                            columns=labels.categories)
+
+    # Row positions of the reviews mentioning a reaction
+    def reviews_mentioning(self, reaction):
+        i = self.reactions.get_loc(reaction)
+        return self.review[self.reaction == i]
+
+
+# data_key identifies both the reviews file and the openFDA data the reactions come from
+@tracked_cache_resource(show_spinner="Matching reviews to reactions...", max_entries=4)
+def build_review_reactions(_index, _reactions, data_key):
+    return freeze(ReviewReactions(_index, _reactions))
@@ -0,0 +1,162 @@
+# Inverted index over the review texts for the "Filter Reviews by Keyword" box
+#
+# Reviews are tokenized once into lowercase alphanumeric terms. Each term maps to a sorted array
+# of the row positions containing it, so keyword lookups are binary searches and array
+# intersections instead of a scan over every review.
+import bisect
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+from shared_store import freeze
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Arrays written by ReviewIndex.save (besides the vocabulary)
+INDEX_ARRAYS = ['doc_offsets', 'doc_tokens', 'postings', 'posting_offsets', 'positions', 'position_offsets']
+
+# Query syntax for ReviewIndex.search: "quoted phrase", prefix*, and bare terms (all ANDed)
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    if pd.isna(text):
+        return []
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class ReviewIndex:
+    def __init__(self, texts):
+        token_lists = [tokenize(text) for text in texts]
+        self.n_docs = len(token_lists)
+
+        # Sorted vocabulary, so a prefix is a contiguous range of term ids
+        self.terms = sorted(set().union(*token_lists))
+        term_ids = {term: i for i, term in enumerate(self.terms)}
+
+        # Each review's token ids in order (CSR layout), used to verify phrases
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=self.n_docs)
+        self.doc_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.doc_tokens = np.fromiter((term_ids[t] for tokens in token_lists for t in tokens),
+                                      dtype=np.int32, count=int(self.doc_offsets[-1]))
+
+        # Postings: for each term, the sorted unique rows containing it (also CSR)
+        docs = np.repeat(np.arange(self.n_docs, dtype=np.int64), lengths)
+        keys = np.unique(self.doc_tokens.astype(np.int64) * max(self.n_docs, 1) + docs)
+        posting_terms = keys // max(self.n_docs, 1)
+        self.postings = (keys % max(self.n_docs, 1)).astype(np.int32)
+        self.posting_offsets = np.searchsorted(posting_terms, np.arange(len(self.terms) + 1))
+
+        # Positions of every occurrence of each term within doc_tokens, grouped by term (for phrases)
+        self.positions = np.argsort(self.doc_tokens, kind="stable").astype(np.int64)
+        self.position_offsets = np.searchsorted(self.doc_tokens[self.positions], np.arange(len(self.terms) + 1))
+
+    # One .npy file per array, so other processes can memory-map the index instead of rebuilding it
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        np.save(os.path.join(directory, 'terms.npy'), np.array(self.terms, dtype=str))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        index = cls.__new__(cls)
+        for name in INDEX_ARRAYS:
+            setattr(index, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+        index.terms = np.load(os.path.join(directory, 'terms.npy')).tolist()
+        index.n_docs = len(index.doc_offsets) - 1
+        return index
+
+    # Range of term ids [start, stop) that begin with prefix
+    def _prefix_range(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        stop = bisect.bisect_left(self.terms, prefix + "\uffff")
+        return start, stop
+
+    def _term_id(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return None
+
+    def term_rows(self, term):
+        i = self._term_id(term)
+        if i is None:
+            return np.empty(0, dtype=np.int32)
+        return self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]]
+
+    def prefix_rows(self, prefix):
+        start, stop = self._prefix_range(prefix)
+        if stop - start == 1:
+            return self.term_rows(self.terms[start])
+        return np.unique(self.postings[self.posting_offsets[start]:self.posting_offsets[stop]])
+
+    # Rows containing the tokens consecutively; with prefix_last the final token only has to start a word
+    def phrase_rows(self, tokens, prefix_last=False):
+        if not tokens:
+            return np.arange(self.n_docs, dtype=np.int32)
+
+        exact = tokens[:-1] if prefix_last else tokens
+        exact_ids = [self._term_id(token) for token in exact]
+        if any(i is None for i in exact_ids):
+            return np.empty(0, dtype=np.int32)
+
+        if len(tokens) == 1:
+            return self.prefix_rows(tokens[0]) if prefix_last else self.term_rows(tokens[0])
+
+        # Start from every occurrence of the first word and check the words that follow it
+        first = exact_ids[0]
+        starts = self.positions[self.position_offsets[first]:self.position_offsets[first + 1]]
+        docs = np.searchsorted(self.doc_offsets, starts, side="right") - 1
+        n = len(tokens)
+        hit = starts + n <= self.doc_offsets[docs + 1]
+        starts, docs = starts[hit], docs[hit]
+
+        hit = np.ones(len(starts), dtype=bool)
+        for k, term_id in enumerate(exact_ids[1:], start=1):
+            hit &= self.doc_tokens[starts + k] == term_id
+        if prefix_last:
+            start, stop = self._prefix_range(tokens[-1])
+            tail = self.doc_tokens[starts + n - 1]
+            hit &= (tail >= start) & (tail < stop)
+        return np.unique(docs[hit]).astype(np.int32)
+
+    # Multi-term query: every bare term, prefix* and "quoted phrase" must match (AND)
+    def search(self, query):
+        rows = None
+        for phrase, word in QUERY_PATTERN.findall(query):
+            if phrase:
+                part = self.phrase_rows(tokenize(phrase))
+            elif word.endswith("*"):
+                prefix_tokens = tokenize(word[:-1])
+                part = self.phrase_rows(prefix_tokens, prefix_last=True)
+            else:
+                part = self.phrase_rows(tokenize(word))
+            rows = part if rows is None else np.intersect1d(rows, part, assume_unique=True)
+        if rows is None:
+            return np.arange(self.n_docs, dtype=np.int32)
+        return rows
+
+    # Closest match to the old substring filter: the keyword as a phrase whose last word may be partial
+    def match_keyword(self, keyword):
+        return self.phrase_rows(tokenize(keyword), prefix_last=True)
+
+
+# Row positions for the "Filter Reviews by Keyword" box (None = no keyword, all rows). The keyword is
+# looked up in the index; keywords without any letters or digits fall back to a plain substring scan.
+def keyword_rows(index, texts, keyword):
+    if not keyword:
+        return None
+    if tokenize(keyword):
+        return index.match_keyword(keyword)
+    return np.flatnonzero(texts.str.contains(keyword, case=False, na=False, regex=False).to_numpy())
+
+
+# data_key identifies the loaded reviews file (path and file signature), so the texts aren't hashed
+@tracked_cache_resource(show_spinner="Indexing reviews...", max_entries=4)
+def build_review_index(_texts, data_key):
+    return freeze(ReviewIndex(_texts))
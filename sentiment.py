@@ -0,0 +1,312 @@
+# Offline / incremental sentiment scoring for the Drugs.com reviews
+#
+# Scores are stored in a sidecar Parquet file keyed by a hash of review_text, so only
+# reviews that have not been seen before are scored. Run as a script to (re)build the
+# sidecar ahead of time:
+#
+#     python sentiment.py Ozempic_Reviews_Drugs.csv --workers 8
+import argparse
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+
+SENTIMENT_SIDECAR_PATH = 'Ozempic_Reviews_Sentiment.parquet'
+SENTIMENT_COLUMNS = ['review_hash', 'polarity', 'subjectivity', 'sentiment']
+
+# Scorer used when none is given ("textblob" or "lexicon"); each scorer has its own sidecar file
+DEFAULT_SCORER = os.environ.get("OZEMPIC_SENTIMENT_SCORER", "textblob")
+
+# Polarity above POSITIVE_THRESHOLD is positive, below NEGATIVE_THRESHOLD negative, anything else neutral
+POSITIVE_THRESHOLD = 0.1
+NEGATIVE_THRESHOLD = -0.1
+
+SENTIMENT_LABELS = ["negative", "neutral", "positive"]
+
+LEXICON_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+NEGATIONS = {"not", "no", "never", "neither", "nor", "without", "cannot"}
+
+
+# Stable key for a review (the same text always maps to the same hash across runs)
+def review_hash(text):
+    if pd.isna(text):
+        return ''
+    return hashlib.blake2b(str(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def hash_reviews(texts):
+    return pd.Series([review_hash(text) for text in texts], dtype='string')
+
+
+def classify_polarity(polarity, positive=POSITIVE_THRESHOLD, negative=NEGATIVE_THRESHOLD):
+    if polarity > positive:
+        return "positive"
+    elif polarity < negative:
+        return "negative"
+    else:
+        return "neutral"
+
+
+# classify_polarity for a whole array of scores, as a categorical; changing the thresholds only relabels
+def classify_polarities(polarity, positive=POSITIVE_THRESHOLD, negative=NEGATIVE_THRESHOLD):
+    polarity = np.asarray(polarity, dtype=np.float64)
+    codes = np.ones(len(polarity), dtype=np.int8)
+    codes[polarity > positive] = 2
+    codes[polarity < negative] = 0
+    return pd.Categorical.from_codes(codes, categories=SENTIMENT_LABELS)
+
+
+# Generate sentiment labels
+def classify_sentiment(text, scorer=DEFAULT_SCORER):
+    if pd.isna(text):
+        return "neutral"
+    return classify_polarity(score_review(text, scorer)[0])
+
+
+def score_review(text, scorer=DEFAULT_SCORER):
+    polarity, subjectivity = get_scorer(scorer).score([text])
+    return (float(polarity[0]), float(subjectivity[0]))
+
+
+# TextBlob's pattern analyzer, one review at a time (the most faithful, and the slowest)
+class TextBlobScorer:
+    name = "textblob"
+    # Below this many reviews a process pool costs more than it saves
+    min_pool_size = 2000
+    chunk_size = 500
+
+    def score(self, texts):
+        from textblob import TextBlob
+
+        polarity, subjectivity = [], []
+        for text in texts:
+            if pd.isna(text):
+                sentiment = (0.0, 0.0)
+            else:
+                sentiment = TextBlob(str(text)).sentiment
+            polarity.append(sentiment[0])
+            subjectivity.append(sentiment[1])
+        return np.array(polarity, dtype=np.float32), np.array(subjectivity, dtype=np.float32)
+
+
+# The same word scores TextBlob uses, compiled into arrays and looked up for a whole batch at once.
+# A review's score is the mean over its lexicon words; a preceding intensifier ("very") scales a
+# word and is not counted itself, and a preceding negation ("not", "don't") multiplies its polarity
+# by -0.5. TextBlob also handles emoticons, exclamation marks and multi-word expressions, so the
+# scores are close to, but not identical with, TextBlobScorer's.
+class LexiconScorer:
+    name = "lexicon"
+    min_pool_size = 50_000
+    chunk_size = 20_000
+
+    def __init__(self, lexicon_path=None):
+        self.words, self.polarity, self.subjectivity, self.intensity, self.modifier = compile_lexicon(lexicon_path)
+
+    def score(self, texts):
+        tokens, lengths = [], []
+        for text in texts:
+            found = [] if pd.isna(text) else LEXICON_TOKEN.findall(str(text).lower())
+            tokens.extend(found)
+            lengths.append(len(found))
+        lengths = np.array(lengths, dtype=np.int64)
+        if not len(tokens):
+            return np.zeros(len(lengths), dtype=np.float32), np.zeros(len(lengths), dtype=np.float32)
+
+        # Look up each distinct token once, then expand to all token positions
+        codes, uniques = pd.factorize(pd.Series(tokens, dtype=object))
+        unique_words = pd.Index(uniques)
+        word = self.words.get_indexer(unique_words)[codes]
+        negation = (unique_words.isin(NEGATIONS) | unique_words.str.endswith("n't"))[codes]
+
+        doc = np.repeat(np.arange(len(lengths)), lengths)
+        known = word >= 0
+        polarity = np.where(known, self.polarity[word], 0.0)
+        subjectivity = np.where(known, self.subjectivity[word], 0.0)
+        modifier = known & self.modifier[word]
+
+        # Position i is preceded by position i - 1 of the same review
+        preceded = np.zeros(len(doc), dtype=bool)
+        preceded[1:] = doc[1:] == doc[:-1]
+        after_modifier = preceded & np.roll(modifier, 1)
+        after_negation = preceded & np.roll(negation, 1)
+        # ("not very good": the negation comes before the intensifier)
+        after_negation |= after_modifier & np.roll(after_negation, 1)
+
+        scale = np.where(after_modifier, self.intensity[np.roll(word, 1)], 1.0)
+        polarity = np.clip(polarity * scale, -1.0, 1.0) * np.where(after_negation, -0.5, 1.0)
+        subjectivity = np.clip(subjectivity * scale, 0.0, 1.0)
+
+        # Intensifiers that modify the next word don't count on their own
+        modifies_next = modifier & np.roll(known & preceded, -1)
+        counted = (known & ~modifies_next).astype(np.float64)
+        n_counted = np.bincount(doc, weights=counted, minlength=len(lengths))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_polarity = np.bincount(doc, weights=polarity * counted, minlength=len(lengths)) / n_counted
+            mean_subjectivity = np.bincount(doc, weights=subjectivity * counted, minlength=len(lengths)) / n_counted
+        return (np.nan_to_num(mean_polarity).astype(np.float32),
+                np.nan_to_num(mean_subjectivity).astype(np.float32))
+
+
+# Word-level polarity, subjectivity and intensity from TextBlob's en-sentiment.xml, averaged over
+# each word's senses. modifier marks adverbs that scale the next word (intensity other than 1).
+@lru_cache(maxsize=None)
+def compile_lexicon(path=None):
+    if path is None:
+        import textblob
+
+        path = os.path.join(os.path.dirname(textblob.__file__), 'en', 'en-sentiment.xml')
+    senses = pd.DataFrame([word.attrib for word in ElementTree.parse(path).getroot().iter('word')])
+    senses = senses.astype({'polarity': 'float64', 'subjectivity': 'float64', 'intensity': 'float64'})
+    senses['modifier'] = senses['pos'].str.startswith('RB') & (senses['intensity'] != 1.0)
+    words = senses.groupby('form', sort=True).agg(
+        polarity=('polarity', 'mean'), subjectivity=('subjectivity', 'mean'),
+        intensity=('intensity', 'mean'), modifier=('modifier', 'any'))
+    return (words.index, words['polarity'].to_numpy(), words['subjectivity'].to_numpy(),
+            words['intensity'].to_numpy(), words['modifier'].to_numpy())
+
+
+SCORERS = {"textblob": TextBlobScorer, "lexicon": LexiconScorer}
+
+
+# One scorer instance per process, so the lexicon is compiled once per worker
+@lru_cache(maxsize=None)
+def get_scorer(name=DEFAULT_SCORER):
+    if name not in SCORERS:
+        raise ValueError(f"Unknown sentiment scorer: {name}")
+    return SCORERS[name]()
+
+
+def sentiment_sidecar_path(scorer=DEFAULT_SCORER):
+    if scorer == "textblob":
+        return SENTIMENT_SIDECAR_PATH
+    return f'Ozempic_Reviews_Sentiment_{scorer}.parquet'
+
+
+def _score_chunk(scorer, texts):
+    return get_scorer(scorer).score(texts)
+
+
+# Polarity and subjectivity arrays for a Series or iterable of texts, in order. Texts are scored in
+# chunks, fanned out over a process pool when there are enough of them for the scorer.
+def score_texts(texts, scorer=DEFAULT_SCORER, workers=None, chunk_size=None):
+    texts = list(texts)
+    if workers == 1 or len(texts) < get_scorer(scorer).min_pool_size:
+        return _score_chunk(scorer, texts)
+
+    chunk_size = chunk_size or get_scorer(scorer).chunk_size
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_score_chunk, [scorer] * len(chunks), chunks))
+    return (np.concatenate([polarity for polarity, _ in results]),
+            np.concatenate([subjectivity for _, subjectivity in results]))
+
+
+# Reviews per second for each scorer over the same texts
+def benchmark_scorers(texts, scorers=None, workers=None, chunk_size=None):
+    texts = list(texts)
+    results = []
+    for name in scorers or list(SCORERS):
+        get_scorer(name)
+        start = time.perf_counter()
+        score_texts(texts, scorer=name, workers=workers, chunk_size=chunk_size)
+        seconds = time.perf_counter() - start
+        results.append({"scorer": name, "reviews": len(texts), "seconds": seconds,
+                        "reviews_per_sec": len(texts) / seconds if seconds > 0 else float('inf')})
+    return pd.DataFrame(results)
+
+
+def read_sidecar(path=SENTIMENT_SIDECAR_PATH):
+    if not os.path.exists(path):
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                             zip(SENTIMENT_COLUMNS, ['string', 'float32', 'float32', 'category'])})
+    return pd.read_parquet(path, columns=SENTIMENT_COLUMNS)
+
+
+# Write to a temporary file first so a crash never leaves a truncated sidecar behind
+def write_sidecar(scores, path=SENTIMENT_SIDECAR_PATH):
+    tmp_path = path + '.tmp'
+    scores.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+# Bring the scorer's sidecar up to date with the given review texts, scoring only unseen reviews
+def update_sidecar(texts, path=None, workers=None, scorer=DEFAULT_SCORER):
+    path = path or sentiment_sidecar_path(scorer)
+    stored = read_sidecar(path)
+    hashes = hash_reviews(texts)
+
+    seen = set(stored['review_hash'])
+    unseen = {}
+    for text, key in zip(texts, hashes):
+        if key not in seen and key not in unseen:
+            unseen[key] = text
+    if not unseen:
+        return stored
+
+    polarity, subjectivity = score_texts(unseen.values(), scorer=scorer, workers=workers)
+    new_scores = pd.DataFrame({
+        'review_hash': pd.Series(list(unseen.keys()), dtype='string'),
+        'polarity': pd.Series(polarity, dtype='float32'),
+        'subjectivity': pd.Series(subjectivity, dtype='float32'),
+        'sentiment': classify_polarities(polarity).astype(str),
+    })
+
+    stored = pd.concat([stored.astype({'sentiment': 'string'}), new_scores], ignore_index=True)
+    stored['sentiment'] = stored['sentiment'].astype('category')
+    write_sidecar(stored, path)
+    return stored
+
+
+# Return a copy of the reviews frame with polarity, subjectivity and sentiment columns. The labels
+# are derived from the stored polarity with the given thresholds, so changing them never rescores.
+def attach_sentiment(reviews, path=None, workers=None, scorer=DEFAULT_SCORER,
+                     positive=POSITIVE_THRESHOLD, negative=NEGATIVE_THRESHOLD):
+    stored = update_sidecar(reviews['review_text'], path=path, workers=workers, scorer=scorer)
+    stored = stored.set_index('review_hash')
+
+    hashes = hash_reviews(reviews['review_text'])
+    scored = stored.reindex(hashes.to_numpy())
+    polarity = scored['polarity'].to_numpy()
+    return reviews.assign(
+        polarity=polarity,
+        subjectivity=scored['subjectivity'].to_numpy(),
+        sentiment=np.asarray(classify_polarities(np.nan_to_num(polarity), positive, negative)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score Drugs.com reviews and store the results in a sidecar file.")
+    parser.add_argument('reviews', nargs='?', default='Ozempic_Reviews_Drugs.csv', help="reviews CSV with a review_text column")
+    parser.add_argument('--scorer', choices=list(SCORERS), default=DEFAULT_SCORER, help="sentiment scorer to use")
+    parser.add_argument('--output', default=None, help="sidecar Parquet file to create or update (default: one per scorer)")
+    parser.add_argument('--workers', type=int, default=None, help="number of scoring processes (default: one per CPU)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="report the throughput of every scorer on the reviews instead of updating the sidecar")
+    args = parser.parse_args()
+
+    reviews = pd.read_csv(args.reviews, encoding='utf-8-sig')
+    if args.benchmark:
+        results = benchmark_scorers(reviews['review_text'], workers=args.workers)
+        for result in results.itertuples():
+            print(f"{result.scorer}: {result.reviews} reviews in {result.seconds:.2f}s "
+                  f"({result.reviews_per_sec:,.0f} reviews/sec)")
+        return
+
+    output = args.output or sentiment_sidecar_path(args.scorer)
+    before = len(read_sidecar(output))
+    start = time.perf_counter()
+    after = len(update_sidecar(reviews['review_text'], path=output, workers=args.workers, scorer=args.scorer))
+    seconds = time.perf_counter() - start
+    print(f"Scored {after - before} new reviews in {seconds:.2f}s "
+          f"({(after - before) / seconds:,.0f} reviews/sec, {after} stored in {output})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Process-wide store for what the sessions share
+#
+# The loaded frames, indexes and count cube are built once per dataset by the cached builders
+# (tracked_cache_resource) and shared by every session. freeze() marks the numpy arrays held by
+# the index and aggregate objects read-only, so those can't be changed in place for the others.
+# The DataFrames themselves (the loaded frames, ReportTables.reports) are not protected: sessions
+# only hold row positions into them, and anything that changes a frame has to copy it first.
+#
+# Results derived from the shared data for one filter state (row selections, sort orders,
+# download files) go in derived_results: a least-recently-used cache with a memory budget instead
+# of an entry count, so the memory used by derived results stays the same however many analysts
+# are connected. Set the budget with OZEMPIC_DERIVED_CACHE_MB (default 256).
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import register_lru_cache
+
+
+DERIVED_CACHE_BUDGET_MB = float(os.environ.get("OZEMPIC_DERIVED_CACHE_MB", "256"))
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+# Approximate memory held by a cached value, in bytes
+def nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    return 64
+
+
+# Mark the numpy arrays held by obj (directly or in dict attributes) read-only; returns obj
+def freeze(obj):
+    for value in vars(obj).values():
+        arrays = value.values() if isinstance(value, dict) else [value]
+        for array in arrays:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+    return obj
+
+
+class DerivedCache:
+    def __init__(self, budget_bytes, name="derived_results"):
+        self.__name__ = name
+        self.budget_bytes = budget_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, size), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # The cached value for key, or compute() stored under it. Two sessions missing the same key at
+    # once both compute it; the computation runs outside the lock so other lookups aren't blocked.
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        self.put(key, value)
+        return value
+
+    # Values larger than the whole budget are returned to the caller but not kept
+    def put(self, key, value):
+        size = nbytes(value)
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.budget_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    # Same fields as functools.lru_cache's cache_info(), with the sizes in bytes
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.budget_bytes, self.current_bytes)
+
+
+derived_results = register_lru_cache(DerivedCache(int(DERIVED_CACHE_BUDGET_MB * 2 ** 20)))
@@ -0,0 +1,101 @@
+# Disproportionality statistics (PRR, ROR, chi-square) for every drug x reaction pair
+#
+# For a drug D and reaction R the reports form a 2x2 table:
+#
+#                    R       not R
+#     D              a       b = n_D - a
+#     not D          c       d = N - a - b - c
+#     (c = n_R - a)
+#
+# The a counts for all pairs come from one vectorized join of the (report, drug) and
+# (report, reaction) pairs in report_model.ReportTables. Only pairs that occur together are kept,
+# as coordinate (sparse) arrays, so the vocabulary size doesn't matter. Everything after that is
+# plain numpy over those arrays.
+import numpy as np
+import pandas as pd
+
+from diagnostics import tracked_cache_resource
+
+
+# Commonly used screening thresholds (Evans et al.): PRR >= 2, chi-square >= 4, at least 3 reports
+SIGNAL_MIN_PRR = 2.0
+SIGNAL_MIN_CHI_SQUARE = 4.0
+SIGNAL_MIN_REPORTS = 3
+
+Z_95 = 1.959964
+
+
+# Reports per (drug, reaction) pair that occur together, plus the per-drug, per-reaction and total report counts
+def cooccurrence_counts(tables):
+    drugs, reactions = tables.drugs, tables.reactions
+
+    # For every (report, drug) pair, one entry per reaction of the same report
+    reactions_per_report = np.bincount(reactions.report, minlength=tables.n_reports)
+    reaction_starts = np.concatenate([[0], np.cumsum(reactions_per_report)[:-1]])
+    repeats = reactions_per_report[drugs.report]
+    drug_pair = np.repeat(np.arange(len(drugs)), repeats)
+    group_starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+    reaction_pair = reaction_starts[drugs.report[drug_pair]] + np.arange(len(drug_pair)) - group_starts
+
+    n_reactions = max(len(reactions.terms), 1)
+    keys, a = np.unique(drugs.term[drug_pair].astype(np.int64) * n_reactions + reactions.term[reaction_pair],
+                        return_counts=True)
+    pairs = pd.DataFrame({
+        "drug": pd.Categorical.from_codes(keys // n_reactions, categories=drugs.terms),
+        "reaction": pd.Categorical.from_codes(keys % n_reactions, categories=reactions.terms),
+        "a": a,
+    })
+    drug_totals = pd.Series(np.bincount(drugs.term, minlength=len(drugs.terms)), index=drugs.terms)
+    reaction_totals = pd.Series(np.bincount(reactions.term, minlength=len(reactions.terms)), index=reactions.terms)
+    return pairs, drug_totals, reaction_totals, tables.n_reports
+
+
+# PRR and ROR with 95% confidence intervals and the Yates-corrected chi-square, for arrays of 2x2 tables
+def contingency_statistics(a, b, c, d, z=Z_95):
+    a, b, c, d = (np.asarray(x, dtype=np.float64) for x in (a, b, c, d))
+    n = a + b + c + d
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prr = (a / (a + b)) / (c / (c + d))
+        prr_se = np.sqrt(1 / a - 1 / (a + b) + 1 / c - 1 / (c + d))
+        ror = (a * d) / (b * c)
+        ror_se = np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+        chi_square = (n * np.maximum(np.abs(a * d - b * c) - n / 2, 0) ** 2
+                      / ((a + b) * (c + d) * (a + c) * (b + d)))
+        return {
+            "prr": prr,
+            "prr_lower": np.exp(np.log(prr) - z * prr_se),
+            "prr_upper": np.exp(np.log(prr) + z * prr_se),
+            "ror": ror,
+            "ror_lower": np.exp(np.log(ror) - z * ror_se),
+            "ror_upper": np.exp(np.log(ror) + z * ror_se),
+            "chi_square": chi_square,
+        }
+
+
+# One row per co-occurring (drug, reaction) pair with its 2x2 table, statistics and signal flag
+def disproportionality(pairs, drug_totals, reaction_totals, n_reports):
+    a = pairs["a"].to_numpy(dtype=np.int64)
+    n_drug = drug_totals.to_numpy(dtype=np.int64)[pairs["drug"].cat.codes.to_numpy()]
+    n_reaction = reaction_totals.to_numpy(dtype=np.int64)[pairs["reaction"].cat.codes.to_numpy()]
+    b = n_drug - a
+    c = n_reaction - a
+    d = n_reports - a - b - c
+
+    results = pairs.assign(b=b, c=c, d=d, **contingency_statistics(a, b, c, d))
+    results["signal"] = ((results["a"] >= SIGNAL_MIN_REPORTS) & (results["prr"] >= SIGNAL_MIN_PRR)
+                         & (results["chi_square"] >= SIGNAL_MIN_CHI_SQUARE))
+    return results
+
+
+# Pairs for one drug (or all drugs), strongest first by the lower confidence bound of the ROR
+def rank_signals(results, drug=None, min_reports=1, by="ror_lower"):
+    if drug is not None:
+        results = results[results["drug"] == drug]
+    results = results[results["a"] >= min_reports]
+    return results.sort_values([by, "a"], ascending=False, na_position="last").reset_index(drop=True)
+
+
+# data_key identifies the loaded dataset (path and file signature), so the tables aren't hashed
+@tracked_cache_resource(show_spinner="Computing disproportionality statistics...", max_entries=4)
+def build_signals(_tables, data_key):
+    return disproportionality(*cooccurrence_counts(_tables))
@@ -0,0 +1,405 @@
+# Bounded-memory streaming summaries of the openFDA reports
+#
+# For feeds that keep growing (ingest_openfda.py deltas) the exact counts behind "Top 10 Most
+# Reported Side Effects" need every report. ReportSketches instead keeps, per patient_sex x serious
+# segment, a fixed-size summary that is updated one batch of reports at a time and can be merged
+# with the summary of another partition:
+#
+#   SpaceSaving   top reactions / drug_name values (reports per term, as in the exact path).
+#                 Keeps `capacity` terms. For a kept term, lower <= true <= count, with
+#                 count - lower <= N / capacity (N = report/term pairs summarized). Every term
+#                 whose true count is above N / capacity is kept.
+#   CountMin      count for any reaction / drug, kept or not. true <= estimate, and
+#                 estimate <= true + eps * N with probability 1 - delta (width = ceil(e / eps),
+#                 depth = ceil(ln(1 / delta))).
+#   HyperLogLog   distinct safetyreportid values. Relative standard error 1.04 / sqrt(2 ** p)
+#                 (about 1.6% at p = 12); a report counted twice is still counted once.
+#
+# Merging two summaries (partitions, or segments for a gender/severity selection) keeps the same
+# bounds, with N the total of both. The sketches are saved next to the data with the data file's
+# signature, like the Trends counts, and ingest_openfda.py adds each new batch to them. The app's
+# "Streaming sketches" counting mode draws the Top 10 and serious / non-serious charts from them.
+#
+#     python sketches.py                        # build from the openFDA file, in chunks of reports
+#     python sketches.py --check                # compare the sketch answers with the exact counts
+import argparse
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import (CHART_COLUMNS, OZEMPIC_DATA_PATH, file_signature, openfda_file_columns, prepare_openfda_data,
+                         read_openfda_file)
+from diagnostics import tracked_cache_resource
+from filters import SEX_CODES
+from report_model import ReportTables
+
+
+SKETCHES_PATH = 'Ozempic_openFDA_Sketches.npz'
+
+SPACE_SAVING_CAPACITY = 256
+COUNT_MIN_EPSILON = 0.001
+COUNT_MIN_DELTA = 0.01
+HYPERLOGLOG_PRECISION = 12
+
+# Segments: patient_sex code (0 = unknown, as in aggregates.py) x serious (Serious / Non-Serious)
+SEX_SEGMENTS = [0, 1, 2]
+SEVERITY_SEGMENTS = ["Serious", "Non-Serious"]
+
+# Sketched term columns of ReportTables
+SKETCHED_TERMS = {"reaction_meddra": "reactions", "drug_name": "drugs"}
+
+STREAM_CHUNK_ROWS = 200_000
+
+
+def _hash_terms(terms, key):
+    return pd.util.hash_array(np.asarray(terms, dtype=object), hash_key=key, categorize=False)
+
+
+# Mergeable Space-Saving summary (Agarwal et al., "Mergeable Summaries"): counts are upper bounds,
+# errors how much of each count may come from terms evicted earlier
+class SpaceSaving:
+    def __init__(self, capacity=SPACE_SAVING_CAPACITY, terms=(), counts=(), errors=(), total=0, truncated=False):
+        self.capacity = int(capacity)
+        self.terms = np.asarray(terms, dtype=object)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.errors = np.asarray(errors, dtype=np.int64)
+        self.total = int(total)
+        self.truncated = bool(truncated)
+
+    # Count assumed for a term not in the summary (0 until something has been evicted)
+    def floor(self):
+        return int(self.counts.min()) if self.truncated and len(self.counts) else 0
+
+    def _frame(self):
+        return pd.DataFrame({"count": self.counts, "error": self.errors}, index=pd.Index(self.terms, dtype=object))
+
+    def merge(self, other):
+        left, right = self._frame(), other._frame()
+        index = left.index.union(right.index)
+        merged = left.reindex(index, fill_value=self.floor()) + right.reindex(index, fill_value=other.floor())
+        truncated = self.truncated or other.truncated or len(merged) > self.capacity
+        # Largest counts first, ties by term so the result doesn't depend on the merge order
+        merged = merged.assign(term=index).sort_values(["count", "term"], ascending=[False, True], kind="stable")
+        merged = merged.head(self.capacity)
+        return SpaceSaving(self.capacity, merged["term"].to_numpy(), merged["count"].to_numpy(),
+                           merged["error"].to_numpy(), self.total + other.total, truncated)
+
+    # Add exact counts for a batch
+    def update(self, terms, counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        keep = counts > 0
+        batch = SpaceSaving(max(int(keep.sum()), 1), np.asarray(terms, dtype=object)[keep], counts[keep],
+                            np.zeros(int(keep.sum()), dtype=np.int64), counts.sum())
+        merged = self.merge(batch)
+        self.terms, self.counts, self.errors = merged.terms, merged.counts, merged.errors
+        self.total, self.truncated = merged.total, merged.truncated
+
+    # Largest n terms with their count (upper bound) and guaranteed lower bound
+    def top(self, n=10):
+        return pd.DataFrame({"count": self.counts[:n], "lower": self.counts[:n] - self.errors[:n]},
+                            index=pd.Index(self.terms[:n], name="term"))
+
+    def error_bound(self):
+        return self.total / self.capacity
+
+
+class CountMin:
+    def __init__(self, epsilon=COUNT_MIN_EPSILON, delta=COUNT_MIN_DELTA, table=None, total=0):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64) if table is None else table
+        self.total = int(total)
+
+    def _columns(self, terms):
+        return [(_hash_terms(terms, f"countmin{row:08d}") % np.uint64(self.width)).astype(np.int64)
+                for row in range(self.depth)]
+
+    def update(self, terms, counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, columns in enumerate(self._columns(terms)):
+            np.add.at(self.table[row], columns, counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, terms):
+        columns = self._columns(terms)
+        return np.min([self.table[row, columns[row]] for row in range(self.depth)], axis=0)
+
+    def merge(self, other):
+        return CountMin(self.epsilon, self.delta, self.table + other.table, self.total + other.total)
+
+    def error_bound(self):
+        return self.epsilon * self.total
+
+
+# Number of bits needed for each value of a uint64 array (0 for 0), exact for all 64 bits
+def _bit_length(values):
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1]).astype(np.int64)
+
+
+class HyperLogLog:
+    def __init__(self, precision=HYPERLOGLOG_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8) if registers is None else registers
+
+    def update(self, values):
+        hashes = pd.util.hash_array(np.asarray(values))
+        suffix_bits = 64 - self.precision
+        buckets = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        suffix = hashes & np.uint64((1 << suffix_bits) - 1)
+        # Position of the leftmost 1 bit in the suffix (suffix_bits + 1 when it is all zeros)
+        ranks = (suffix_bits - _bit_length(suffix) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Small cardinalities: linear counting over the empty registers
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def merge(self, other):
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class SegmentSketches:
+    def __init__(self, reactions=None, drugs=None, reaction_counts=None, drug_counts=None, reports=None):
+        self.reactions = reactions or SpaceSaving()
+        self.drugs = drugs or SpaceSaving()
+        self.reaction_counts = reaction_counts or CountMin()
+        self.drug_counts = drug_counts or CountMin()
+        self.reports = reports or HyperLogLog()
+
+    def merge(self, other):
+        return SegmentSketches(self.reactions.merge(other.reactions), self.drugs.merge(other.drugs),
+                               self.reaction_counts.merge(other.reaction_counts),
+                               self.drug_counts.merge(other.drug_counts), self.reports.merge(other.reports))
+
+
+def _segment_names(genders=None, severity="All"):
+    sexes = SEX_SEGMENTS
+    selected = [SEX_CODES[g] for g in SEX_CODES if genders is not None and g in genders]
+    if len(selected) == 1:
+        sexes = selected
+    severities = [severity] if severity in SEVERITY_SEGMENTS else SEVERITY_SEGMENTS
+    return [(sex, serious) for sex in sexes for serious in severities]
+
+
+class ReportSketches:
+    def __init__(self, segments=None):
+        self.segments = segments or {key: SegmentSketches() for key in _segment_names()}
+
+    # Add the reports of a report_model.ReportTables (which must not already be counted)
+    def add(self, tables):
+        reports = tables.reports
+        sex = reports["patient_sex"].to_numpy()
+        sex = np.where(np.isin(sex, SEX_SEGMENTS), sex, 0)
+        serious = reports["serious"].to_numpy() == 1
+        ids = reports["safetyreportid"].to_numpy()
+        for (sex_code, severity), sketches in self.segments.items():
+            mask = (sex == sex_code) & (serious if severity == "Serious" else ~serious)
+            if not mask.any():
+                continue
+            sketches.reports.update(ids[mask])
+            reaction_counts = tables.reactions.counts(mask)
+            sketches.reactions.update(reaction_counts.index, reaction_counts.to_numpy())
+            sketches.reaction_counts.update(reaction_counts.index, reaction_counts.to_numpy())
+            if tables.drugs is not None:
+                drug_counts = tables.drugs.counts(mask)
+                sketches.drugs.update(drug_counts.index, drug_counts.to_numpy())
+                sketches.drug_counts.update(drug_counts.index, drug_counts.to_numpy())
+
+    # Another partition's sketches merged into a new ReportSketches
+    def merge(self, other):
+        return ReportSketches({key: sketches.merge(other.segments[key]) for key, sketches in self.segments.items()})
+
+    # The segments for a gender selection and severity, merged into one
+    def selection(self, genders=None, severity="All"):
+        keys = _segment_names(genders, severity)
+        merged = self.segments[keys[0]]
+        for key in keys[1:]:
+            merged = merged.merge(self.segments[key])
+        return merged
+
+    # Estimated top reactions, like ReactionCube.reaction_counts but without the age filter
+    def top_reactions(self, genders=None, severity="All", n=10):
+        return self.selection(genders, severity).reactions.top(n)
+
+    def top_drugs(self, genders=None, severity="All", n=10):
+        return self.selection(genders, severity).drugs.top(n)
+
+    def reaction_estimates(self, terms, genders=None, severity="All"):
+        return pd.Series(self.selection(genders, severity).reaction_counts.estimate(terms), index=terms)
+
+    def distinct_reports(self, genders=None, severity="All"):
+        return self.selection(genders, severity).reports.estimate()
+
+    # Estimated serious (1) and non-serious (2) report counts, indexed like ReactionCube.severity_counts
+    def severity_counts(self, genders=None):
+        counts = [round(self.distinct_reports(genders, severity)) for severity in SEVERITY_SEGMENTS]
+        return pd.Series(counts, index=pd.Index([1, 2], name="serious"), name="count")
+
+    # Absolute bounds for the selection (relative for the report count)
+    def error_bounds(self, genders=None, severity="All"):
+        sketches = self.selection(genders, severity)
+        return {
+            "top_reactions": sketches.reactions.error_bound(),
+            "top_drugs": sketches.drugs.error_bound(),
+            "reaction_estimates": sketches.reaction_counts.error_bound(),
+            "drug_estimates": sketches.drug_counts.error_bound(),
+            "distinct_reports_relative": sketches.reports.relative_error(),
+            "count_min_confidence": 1 - sketches.reaction_counts.delta,
+        }
+
+    def save(self, path, data_signature):
+        arrays = {"data_signature": repr(data_signature)}
+        for i, sketches in enumerate(self.segments.values()):
+            for name in SKETCHED_TERMS.values():
+                summary = getattr(sketches, name)
+                arrays[f"{i}_{name}_terms"] = np.asarray(summary.terms, dtype=str)
+                arrays[f"{i}_{name}_counts"] = summary.counts
+                arrays[f"{i}_{name}_errors"] = summary.errors
+                arrays[f"{i}_{name}_state"] = np.array([summary.capacity, summary.total, summary.truncated])
+            arrays[f"{i}_reaction_counts"] = sketches.reaction_counts.table
+            arrays[f"{i}_drug_counts"] = sketches.drug_counts.table
+            arrays[f"{i}_count_totals"] = np.array([sketches.reaction_counts.total, sketches.drug_counts.total])
+            arrays[f"{i}_reports"] = sketches.reports.registers
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            segments = {}
+            for i, key in enumerate(_segment_names()):
+                summaries = {}
+                for name in SKETCHED_TERMS.values():
+                    capacity, total, truncated = stored[f"{i}_{name}_state"]
+                    summaries[name] = SpaceSaving(capacity, stored[f"{i}_{name}_terms"].astype(object),
+                                                  stored[f"{i}_{name}_counts"], stored[f"{i}_{name}_errors"],
+                                                  total, truncated)
+                reaction_total, drug_total = stored[f"{i}_count_totals"]
+                registers = stored[f"{i}_reports"]
+                segments[key] = SegmentSketches(
+                    summaries["reactions"], summaries["drugs"],
+                    CountMin(table=stored[f"{i}_reaction_counts"], total=reaction_total),
+                    CountMin(table=stored[f"{i}_drug_counts"], total=drug_total),
+                    HyperLogLog(int(np.log2(len(registers))), registers))
+            return cls(segments), str(stored["data_signature"])
+
+
+# Saved sketches for data_path, or None when they are missing or were built from a different version of it
+def load_synced_sketches(data_path, sketches_path=SKETCHES_PATH):
+    if not os.path.exists(sketches_path) or not os.path.exists(data_path):
+        return None
+    sketches, signature = ReportSketches.load(sketches_path)
+    return sketches if signature == repr(file_signature(data_path)) else None
+
+
+# Frames of whole reports from a CSV read in chunks. The rows of a report are next to each other in
+# the file; those that straddle two chunks are held back and sent with the next one, so no report
+# is split across batches.
+def iter_report_chunks(path, chunk_rows=STREAM_CHUNK_ROWS):
+    if not path.endswith('.csv'):
+        yield prepare_openfda_data(read_openfda_file(path, CHART_COLUMNS))
+        return
+
+    from data_loader import OPENFDA_DTYPES
+
+    # (patient_age_unit only when the file has it, as in read_openfda_file)
+    file_columns = openfda_file_columns(path)
+    columns = [c for c in CHART_COLUMNS if c != 'patient_age_unit' or c in file_columns]
+    dtypes = {c: t for c, t in OPENFDA_DTYPES.items() if c in columns}
+    held = None
+    for chunk in pd.read_csv(path, dtype=dtypes, usecols=columns, encoding='utf-8-sig', chunksize=chunk_rows):
+        if held is not None:
+            chunk = pd.concat([held, chunk], ignore_index=True)
+        last_report = chunk['safetyreportid'].iloc[-1]
+        tail = (chunk['safetyreportid'] == last_report).to_numpy()
+        held = chunk[tail]
+        if not tail.all():
+            yield prepare_openfda_data(chunk[~tail])
+    if held is not None and len(held):
+        yield prepare_openfda_data(held)
+
+
+def build_sketches(path=OZEMPIC_DATA_PATH, chunk_rows=STREAM_CHUNK_ROWS):
+    sketches = ReportSketches()
+    for chunk in iter_report_chunks(path, chunk_rows):
+        sketches.add(ReportTables(chunk))
+    return sketches
+
+
+# Sketches for the app's streaming counting mode, reusing the saved file when it matches the data
+# (otherwise built from the file in chunks and saved, so later ingests keep them up to date)
+@tracked_cache_resource(show_spinner="Building report sketches...", max_entries=4)
+def build_report_sketches(data_key, sketches_path=SKETCHES_PATH):
+    data_path, signature = data_key
+    sketches = load_synced_sketches(data_path, sketches_path)
+    if sketches is None:
+        sketches = build_sketches(data_path)
+        sketches.save(sketches_path, signature)
+    return sketches
+
+
+# Sketch answers next to the exact counts for every segment selection
+def compare_with_exact(sketches, tables, n=10):
+    rows = []
+    for genders in (["Male", "Female"], ["Male"], ["Female"]):
+        for severity in ["All"] + SEVERITY_SEGMENTS:
+            keys = _segment_names(genders, severity)
+            sex = tables.reports["patient_sex"].to_numpy()
+            sex = np.where(np.isin(sex, SEX_SEGMENTS), sex, 0)
+            serious = np.where(tables.reports["serious"].to_numpy() == 1, "Serious", "Non-Serious")
+            mask = np.zeros(tables.n_reports, dtype=bool)
+            for sex_code, segment_severity in keys:
+                mask |= (sex == sex_code) & (serious == segment_severity)
+
+            exact = tables.reactions.counts(mask)
+            estimated = sketches.top_reactions(genders, severity, n)
+            top_exact = exact.sort_values(ascending=False, kind="stable").head(n)
+            bounds = sketches.error_bounds(genders, severity)
+            rows.append({
+                "genders": "+".join(genders), "severity": severity,
+                "top_overlap": len(set(estimated.index) & set(top_exact.index)) / max(len(top_exact), 1),
+                "max_top_error": int((estimated["count"] - exact.reindex(estimated.index, fill_value=0)).max()
+                                     if len(estimated) else 0),
+                "top_bound": bounds["top_reactions"],
+                "max_count_min_error": int((sketches.reaction_estimates(list(exact.index), genders, severity)
+                                            - exact).max() if len(exact) else 0),
+                "count_min_bound": bounds["reaction_estimates"],
+                "reports": int(mask.sum()),
+                "reports_estimate": round(sketches.distinct_reports(genders, severity)),
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the streaming report sketches from the openFDA data.")
+    parser.add_argument('--data', default=OZEMPIC_DATA_PATH, help="openFDA CSV or Parquet file")
+    parser.add_argument('-o', '--output', default=SKETCHES_PATH)
+    parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS)
+    parser.add_argument('--check', action='store_true', help="compare with the exact counts instead of saving")
+    args = parser.parse_args()
+
+    sketches = build_sketches(args.data, args.chunk_rows)
+    if args.check:
+        tables = ReportTables(prepare_openfda_data(read_openfda_file(args.data, CHART_COLUMNS)))
+        print(compare_with_exact(sketches, tables).to_string(index=False))
+        return
+    sketches.save(args.output, file_signature(args.data))
+    print(f"Saved sketches to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Reproducible startup-time check
+#
+#     python startup_check.py --repeat 5 -o startup.json
+#     python startup_check.py --max-first-render 10        # exit 1 if the median cold first render is slower
+#
+# Every measurement runs in a fresh Python process, so nothing is cached or imported beforehand:
+#   import          importing app.py's modules, and which heavy libraries that pulled in
+#   cold            the first rerun of app.py with empty caches (what a new container's first user
+#                   waits for), then a second rerun with the caches built
+#   prewarmed       warmup.py's cache build, then the first rerun on the warmed caches
+# Reruns are driven headlessly with Streamlit's AppTest. The medians over --repeat runs are written
+# as JSON, tagged with the git commit, like benchmark.py.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+MODES = ["import", "cold", "prewarmed"]
+
+# Libraries that should only be imported once a chart is drawn or a review has to be scored
+DEFERRED_MODULES = ["matplotlib", "textblob", "duckdb"]
+
+APP_MODULES = ["app_data", "charts", "diagnostics", "explorer", "export", "search_index", "sentiment", "signals",
+               "trends"]
+
+RENDER_TIMEOUT_SECONDS = 600
+
+
+def _first_render():
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    app = AppTest.from_file(APP_PATH, default_timeout=RENDER_TIMEOUT_SECONDS).run()
+    seconds = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(f"app.py raised: {app.exception[0].message}")
+    return seconds
+
+
+# One measurement (runs in the child process)
+def measure(mode):
+    import importlib
+
+    result = {}
+    start = time.perf_counter()
+    for name in APP_MODULES:
+        importlib.import_module(name)
+    result["import_seconds"] = time.perf_counter() - start
+    result["deferred_loaded"] = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    if mode == "cold":
+        result["first_render_seconds"] = _first_render()
+        result["second_render_seconds"] = _first_render()
+    elif mode == "prewarmed":
+        from warmup import warm_caches
+
+        start = time.perf_counter()
+        warm_caches()
+        result["warmup_seconds"] = time.perf_counter() - start
+        result["first_render_seconds"] = _first_render()
+    return result
+
+
+def run_measurement(mode):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", mode], cwd=APP_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_checks(modes, repeat):
+    from benchmark import git_commit
+    from sentiment import DEFAULT_SCORER, sentiment_sidecar_path
+
+    results = {}
+    for mode in modes:
+        runs = [run_measurement(mode) for _ in range(repeat)]
+        summary = {key: statistics.median(run[key] for run in runs) for key in runs[0] if key.endswith("_seconds")}
+        summary["deferred_loaded"] = sorted({name for run in runs for name in run["deferred_loaded"]})
+        summary["runs"] = runs
+        results[mode] = summary
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "query_backend": os.environ.get("OZEMPIC_QUERY_BACKEND", "pandas"),
+        "sentiment_scorer": DEFAULT_SCORER,
+        # Without the sidecar the first render also scores every review
+        "sentiment_sidecar": os.path.exists(os.path.join(APP_DIR, sentiment_sidecar_path(DEFAULT_SCORER))),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app.py's startup time in fresh processes.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per mode (the median is reported)")
+    parser.add_argument("--max-first-render", type=float, default=None,
+                        help="fail if the median cold first render takes longer (seconds)")
+    parser.add_argument("-o", "--output", default=None, help="write the JSON results here (default: stdout)")
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    run = run_checks(args.modes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(run, out, indent=2)
+    else:
+        json.dump(run, sys.stdout, indent=2)
+        print()
+
+    if args.max_first_render is not None and "cold" in run["results"]:
+        first_render = run["results"]["cold"]["first_render_seconds"]
+        if first_render > args.max_first_render:
+            print(f"Cold first render took {first_render:.2f} s (limit {args.max_first_render:.2f} s)",
+                  file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Synthetic openFDA-shaped and review-shaped datasets for benchmark.py
+#
+#     python synthetic_data.py --rows 1000000 --reviews 100000 -o bench_data
+#
+# The openFDA rows have the same columns as Ozempic_openFDA_Data.csv: several (reaction, drug)
+# rows per report sharing the report-level fields, skewed reaction/drug frequencies, a few
+# unrealistic ages for the age filter to drop, and YYYYMMDD receive dates. Reviews are built from
+# the words of the real reviews plus reaction terms, so keyword search, sentiment scoring and the
+# reaction matcher have realistic work to do. Term lists come from the real CSVs when they are
+# present. Everything is generated in chunks, so 10^7 rows never need one huge intermediate list.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import OZEMPIC_DATA_PATH, OZEMPIC_REVIEWS_DATA_PATH
+from ingest_openfda import OPENFDA_COLUMNS
+from search_index import tokenize
+
+
+GENERATE_CHUNK_ROWS = 1_000_000
+
+# Used when the real CSVs aren't available
+FALLBACK_REACTIONS = ['Nausea', 'Vomiting', 'Diarrhoea', 'Constipation', 'Abdominal pain', 'Headache',
+                      'Dizziness', 'Pancreatitis', 'Decreased appetite', 'Fatigue', 'Weight decreased',
+                      'Blood glucose increased', 'Dyspepsia', 'Injection site pain', 'Cholecystitis']
+FALLBACK_DRUGS = ['OZEMPIC', 'METFORMIN', 'LANTUS', 'TRULICITY', 'JARDIANCE', 'LISINOPRIL', 'ATORVASTATIN']
+FALLBACK_WORDS = ['i', 'the', 'and', 'it', 'to', 'was', 'my', 'have', 'this', 'weight', 'lost', 'lbs',
+                  'week', 'dose', 'started', 'taking', 'ozempic', 'sugar', 'great', 'bad', 'good', 'side',
+                  'effects', 'feel', 'sick', 'happy', 'not', 'very', 'doctor', 'months', 'a1c']
+
+COUNTRIES = ['US', 'CA', 'GB', 'DE', 'FR', 'JP', 'BR']
+QUALIFICATIONS = [1.0, 2.0, 3.0, 5.0, np.nan]
+ROUTES = [58.0, 65.0, 48.0, 67.0, np.nan]
+INDICATIONS = ['Type 2 diabetes mellitus', 'Weight decreased', 'Obesity', 'Product used for unknown indication']
+
+FIRST_DAY = np.datetime64('2014-01-01')
+LAST_DAY = np.datetime64('2024-12-31')
+
+
+# Reaction terms, drug names and review words, from the real data where available
+def vocabulary(openfda_path=OZEMPIC_DATA_PATH, reviews_path=OZEMPIC_REVIEWS_DATA_PATH):
+    reactions, drugs, words = FALLBACK_REACTIONS, FALLBACK_DRUGS, FALLBACK_WORDS
+    if os.path.exists(openfda_path):
+        real = pd.read_csv(openfda_path, usecols=['reaction_meddra', 'drug_name'], encoding='utf-8-sig')
+        reactions = real['reaction_meddra'].dropna().value_counts().index.tolist() or reactions
+        drugs = real['drug_name'].dropna().value_counts().index.tolist() or drugs
+    if os.path.exists(reviews_path):
+        texts = pd.read_csv(reviews_path, encoding='utf-8-sig')['review_text']
+        words = pd.Series([token for text in texts for token in tokenize(text)]).value_counts().index.tolist() \
+            or words
+    return reactions, drugs, words
+
+
+# Zipf-like probabilities for a vocabulary ordered from most to least common
+def _zipf(n, exponent=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _openfda_chunk(rng, n_rows, first_report, rows_per_report, reactions, drugs):
+    # Reports are contiguous runs of rows with a geometric number of rows each
+    n_reports = max(1, int(np.ceil(n_rows / rows_per_report)))
+    row_report = np.repeat(np.arange(n_reports), rng.geometric(1 / rows_per_report, n_reports))[:n_rows]
+    if len(row_report) < n_rows:
+        row_report = np.concatenate([row_report, np.arange(n_reports, n_reports + n_rows - len(row_report))])
+    n_reports = int(row_report[-1]) + 1
+
+    days = rng.integers(0, int((LAST_DAY - FIRST_DAY).astype(int)) + 1, n_reports)
+    dates = pd.DatetimeIndex(FIRST_DAY + days.astype('timedelta64[D]'))
+    ages = np.clip(rng.normal(55, 14, n_reports), 18, 95).round()
+    # About 1% unrealistic ages (the loaders drop them) and a few non-year age units
+    unrealistic = rng.random(n_reports) < 0.01
+    ages[unrealistic] = rng.choice([-1.0, 150.0, 999.0], unrealistic.sum())
+    age_units = np.where(rng.random(n_reports) < 0.99, 'Years', 'Months')
+
+    report = {
+        'safetyreportid': 10_000_000 + first_report + np.arange(n_reports, dtype=np.int64),
+        'serious': np.where(rng.random(n_reports) < 0.6, 1, 2),
+        'seriousnessdeath': (rng.random(n_reports) < 0.02).astype(np.int64),
+        'receivedate': (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy(),
+        'reportercountry': rng.choice(COUNTRIES, n_reports, p=_zipf(len(COUNTRIES), 2.0)),
+        'reporterqualification': rng.choice(QUALIFICATIONS, n_reports),
+        'patient_age': ages.astype(np.int64),
+        'patient_age_unit': age_units,
+        'patient_sex': rng.choice([1, 2], n_reports, p=[0.35, 0.65]),
+    }
+    chunk = pd.DataFrame({column: values[row_report] for column, values in report.items()})
+
+    # OZEMPIC is the suspect drug on a large share of rows, the rest follow a skewed distribution
+    drug_names = np.asarray(drugs, dtype=object)
+    row_drugs = drug_names[rng.choice(len(drug_names), n_rows, p=_zipf(len(drug_names)))]
+    row_drugs[rng.random(n_rows) < 0.4] = 'OZEMPIC'
+    chunk['reaction_meddra'] = np.asarray(reactions, dtype=object)[
+        rng.choice(len(reactions), n_rows, p=_zipf(len(reactions)))]
+    chunk['drug_name'] = row_drugs
+    chunk['drug_characterization'] = np.where(row_drugs == 'OZEMPIC', 1, rng.choice([1, 2], n_rows))
+    chunk['drug_admin_route'] = rng.choice(ROUTES, n_rows)
+    chunk['drug_indication'] = rng.choice(INDICATIONS, n_rows)
+    return chunk[OPENFDA_COLUMNS], n_reports
+
+
+# Frames of the openFDA CSV schema, about rows_per_report rows per report, n_rows rows in total
+def iter_openfda_chunks(n_rows, seed=0, rows_per_report=3.0, vocab=None, chunk_rows=GENERATE_CHUNK_ROWS):
+    reactions, drugs, _ = vocab or vocabulary()
+    rng = np.random.default_rng(seed)
+    first_report = 0
+    for start in range(0, n_rows, chunk_rows):
+        chunk, n_reports = _openfda_chunk(rng, min(chunk_rows, n_rows - start), first_report, rows_per_report,
+                                          reactions, drugs)
+        first_report += n_reports
+        yield chunk
+
+
+# Review texts of 20-200 words, some mentioning reaction terms
+def iter_review_chunks(n_reviews, seed=0, vocab=None, chunk_rows=GENERATE_CHUNK_ROWS // 10):
+    reactions, _, words = vocab or vocabulary()
+    rng = np.random.default_rng(seed + 1)
+    words = np.asarray(words, dtype=object)
+    reaction_words = np.asarray([term.lower() for term in reactions], dtype=object)
+    word_p = _zipf(len(words), 1.0)
+    for start in range(0, n_reviews, chunk_rows):
+        n = min(chunk_rows, n_reviews - start)
+        lengths = rng.integers(20, 201, n)
+        tokens = words[rng.choice(len(words), int(lengths.sum()), p=word_p)]
+        # About one word in 40 is replaced by a reaction term
+        mention = rng.random(len(tokens)) < 0.025
+        tokens[mention] = reaction_words[rng.choice(len(reaction_words), mention.sum(),
+                                                    p=_zipf(len(reaction_words)))]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        texts = [" ".join(tokens[offsets[i]:offsets[i + 1]]).capitalize() + "." for i in range(n)]
+        yield pd.DataFrame({'review_text': texts})
+
+
+def generate_openfda(n_rows, seed=0, rows_per_report=3.0, vocab=None):
+    return pd.concat(iter_openfda_chunks(n_rows, seed, rows_per_report, vocab), ignore_index=True)
+
+
+def generate_reviews(n_reviews, seed=0, vocab=None):
+    return pd.concat(iter_review_chunks(n_reviews, seed, vocab), ignore_index=True)
+
+
+# Write the chunks as one CSV with the same encoding as the real files
+def write_chunks_csv(chunks, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as out:
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(out, index=False, header=header)
+            header = False
+    os.replace(tmp_path, path)
+
+
+# Generated CSV paths for a size and seed (existing files are reused)
+def synthetic_paths(output_dir, n_rows, n_reviews, seed=0):
+    return (os.path.join(output_dir, f'openfda_{n_rows}_seed{seed}.csv'),
+            os.path.join(output_dir, f'reviews_{n_reviews}_seed{seed}.csv'))
+
+
+def write_synthetic_data(output_dir, n_rows, n_reviews, seed=0, vocab=None):
+    os.makedirs(output_dir, exist_ok=True)
+    openfda_path, reviews_path = synthetic_paths(output_dir, n_rows, n_reviews, seed)
+    if not os.path.exists(openfda_path) or not os.path.exists(reviews_path):
+        vocab = vocab or vocabulary()
+    if not os.path.exists(openfda_path):
+        write_chunks_csv(iter_openfda_chunks(n_rows, seed, vocab=vocab), openfda_path)
+    if not os.path.exists(reviews_path):
+        write_chunks_csv(iter_review_chunks(n_reviews, seed, vocab=vocab), reviews_path)
+    return openfda_path, reviews_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic openFDA and review CSVs for benchmarking.")
+    parser.add_argument('--rows', type=int, default=100_000, help="number of openFDA rows")
+    parser.add_argument('--reviews', type=int, default=None, help="number of reviews (default: same as --rows)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output-dir', default='bench_data')
+    args = parser.parse_args()
+
+    n_reviews = args.reviews if args.reviews is not None else args.rows
+    openfda_path, reviews_path = write_synthetic_data(args.output_dir, args.rows, n_reviews, args.seed)
+    print(f"Wrote {args.rows} openFDA rows to {openfda_path} and {n_reviews} reviews to {reviews_path}")
+
+
+if __name__ == "__main__":
+    main()
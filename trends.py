@@ -0,0 +1,190 @@
+# Per-period report and reaction counts for the Trends tab
+#
+# Counts are kept per calendar month of receivedate (quarters and years are sums of months):
+# the number of reports per month, and the number of reports mentioning each reaction per month.
+# They are saved next to the data with the data file's signature, and ingest_openfda.py adds each
+# new batch of reports to them, so a refresh never has to regroup the raw rows.
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import file_signature
+from diagnostics import tracked_cache_resource
+
+
+TREND_COUNTS_PATH = 'Ozempic_openFDA_Trends.npz'
+
+PERIODS = {"Month": 1, "Quarter": 3}
+
+
+def _month_numbers(dates):
+    dates = pd.to_datetime(pd.Series(dates))
+    valid = dates.notna().to_numpy()
+    months = np.zeros(len(dates), dtype=np.int64)
+    months[valid] = dates[valid].dt.year.to_numpy() * 12 + dates[valid].dt.month.to_numpy() - 1
+    return months, valid
+
+
+class PeriodCounts:
+    def __init__(self, first_month, report_counts, reaction_counts, reactions):
+        # first_month is year * 12 + (month - 1) of the first row, always a January
+        self.first_month = int(first_month)
+        self.report_counts = report_counts
+        self.reaction_counts = reaction_counts
+        self.reactions = list(reactions)
+
+    @classmethod
+    def empty(cls):
+        return cls(0, np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.int32), [])
+
+    @classmethod
+    def from_tables(cls, tables):
+        counts = cls.empty()
+        counts.add(tables)
+        return counts
+
+    # From already grouped counts: months are year * 12 + (month - 1), reaction_terms are strings
+    @classmethod
+    def from_aggregates(cls, report_months, report_totals, reaction_months, reaction_terms, reaction_totals):
+        counts = cls.empty()
+        report_months = np.asarray(report_months, dtype=np.int64)
+        if not len(report_months):
+            return counts
+        reactions, term_codes = np.unique(np.asarray(reaction_terms, dtype=str), return_inverse=True)
+        counts.reactions = reactions.tolist()
+        counts._grow(int(report_months.min()), int(report_months.max()), len(counts.reactions))
+        np.add.at(counts.report_counts, report_months - counts.first_month, np.asarray(report_totals, dtype=np.int64))
+        np.add.at(counts.reaction_counts,
+                  (np.asarray(reaction_months, dtype=np.int64) - counts.first_month, term_codes),
+                  np.asarray(reaction_totals, dtype=np.int32))
+        return counts
+
+    def _grow(self, first_month, last_month, n_reactions):
+        if len(self.report_counts):
+            first_month = min(first_month, self.first_month)
+            last_month = max(last_month, self.first_month + len(self.report_counts) - 1)
+        first_month -= first_month % 12
+        n_months = last_month - first_month + 1
+
+        report_counts = np.zeros(n_months, dtype=np.int64)
+        reaction_counts = np.zeros((n_months, n_reactions), dtype=np.int32)
+        if len(self.report_counts):
+            offset = self.first_month - first_month
+            report_counts[offset:offset + len(self.report_counts)] = self.report_counts
+            reaction_counts[offset:offset + len(self.report_counts), :self.reaction_counts.shape[1]] = \
+                self.reaction_counts
+        self.first_month = first_month
+        self.report_counts = report_counts
+        self.reaction_counts = reaction_counts
+
+    # Add the reports of a report_model.ReportTables (which must not already be counted)
+    def add(self, tables):
+        months, valid = _month_numbers(tables.reports['receivedate'])
+        if not valid.any():
+            return
+
+        # Map this batch's reaction vocabulary onto ours, appending new terms
+        positions = {term: i for i, term in enumerate(self.reactions)}
+        for term in tables.reactions.terms:
+            if term not in positions:
+                positions[term] = len(self.reactions)
+                self.reactions.append(term)
+        term_map = np.array([positions[term] for term in tables.reactions.terms], dtype=np.int64)
+
+        self._grow(int(months[valid].min()), int(months[valid].max()), len(self.reactions))
+        rows = months - self.first_month
+        np.add.at(self.report_counts, rows[valid], 1)
+
+        pair_reports = tables.reactions.report
+        keep = valid[pair_reports]
+        np.add.at(self.reaction_counts, (rows[pair_reports[keep]], term_map[tables.reactions.term[keep]]), 1)
+
+    # Period start dates plus report and reaction counts summed to months or quarters
+    def by_period(self, period="Month"):
+        step = PERIODS[period]
+        n_periods = -(-len(self.report_counts) // step)
+        pad = n_periods * step - len(self.report_counts)
+        reports = np.pad(self.report_counts, (0, pad)).reshape(n_periods, step).sum(axis=1)
+        reactions = np.pad(self.reaction_counts, ((0, pad), (0, 0))).reshape(n_periods, step, -1).sum(axis=1)
+
+        months = self.first_month + np.arange(n_periods) * step
+        index = pd.DatetimeIndex(pd.to_datetime({"year": months // 12, "month": months % 12 + 1, "day": 1}),
+                                 name="period")
+        return index, reports, reactions
+
+    def save(self, path, data_signature):
+        np.savez_compressed(path, first_month=self.first_month, report_counts=self.report_counts,
+                            reaction_counts=self.reaction_counts, reactions=np.array(self.reactions, dtype=str),
+                            data_signature=repr(data_signature))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            counts = cls(int(stored['first_month']), stored['report_counts'], stored['reaction_counts'],
+                         stored['reactions'].tolist())
+            return counts, str(stored['data_signature'])
+
+
+# Saved counts for data_path, or None when they are missing or were built from a different version of it
+def load_synced_counts(data_path, counts_path=TREND_COUNTS_PATH):
+    if not os.path.exists(counts_path) or not os.path.exists(data_path):
+        return None
+    counts, signature = PeriodCounts.load(counts_path)
+    if signature != repr(file_signature(data_path)):
+        return None
+    return counts
+
+
+# Counts for the loaded report tables, reusing the saved file when it matches the data
+@tracked_cache_resource(show_spinner="Counting reports per period...", max_entries=4)
+def build_period_counts(_tables, data_key, counts_path=TREND_COUNTS_PATH):
+    data_path, signature = data_key
+    counts = load_synced_counts(data_path, counts_path)
+    if counts is None:
+        counts = PeriodCounts.from_tables(_tables)
+        counts.save(counts_path, signature)
+    return counts
+
+
+# Trailing mean over the last `window` periods (NaN until a full window is available)
+def rolling_mean(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if window <= len(values):
+        sums = np.cumsum(np.concatenate([[0.0], values]))
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+# Change against the same period one year earlier, as (difference, percent change)
+def year_over_year(values, period="Month"):
+    lag = 12 // PERIODS[period]
+    values = np.asarray(values, dtype=np.float64)
+    delta = np.full(len(values), np.nan)
+    percent = np.full(len(values), np.nan)
+    if len(values) > lag:
+        previous = values[:-lag]
+        delta[lag:] = values[lag:] - previous
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent[lag:] = np.where(previous > 0, delta[lag:] / previous * 100, np.nan)
+    return delta, percent
+
+
+# Frames for the Trends tab: report volume with rolling mean and year-over-year change, and the
+# per-period counts of the top_n reactions over the whole time span
+def trend_frames(counts, period="Month", window=3, top_n=5):
+    index, reports, reactions = counts.by_period(period)
+    delta, percent = year_over_year(reports, period)
+    volume = pd.DataFrame({
+        "Reports": reports,
+        f"Rolling Mean ({window})": rolling_mean(reports, window),
+        "YoY Change": delta,
+        "YoY Change (%)": percent,
+    }, index=index)
+
+    totals = reactions.sum(axis=0)
+    top = np.argsort(-totals, kind="stable")[:top_n]
+    top = top[totals[top] > 0]
+    top_reactions = pd.DataFrame(reactions[:, top], index=index, columns=[counts.reactions[i] for i in top])
+    return volume, top_reactions
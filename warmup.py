@@ -0,0 +1,76 @@
+# Prewarmed server entry point for fast cold starts
+#
+#     python warmup.py                              # instead of: streamlit run app.py
+#     python warmup.py --server.port 8080           # other arguments are passed to streamlit run
+#     python warmup.py --only                       # build the caches and exit (e.g. to time them)
+#
+# Starts a background thread that builds the app's caches (datasets, sentiment scores, review
+# index, reaction matches, count cube, trend counts, signals), then starts the Streamlit server in
+# the same process. The caches are process-wide, so the first session finds them built (or waits
+# only for what is still in progress) instead of building everything itself.
+# Matplotlib is imported by the warm-up too; without it (streamlit run app.py), the plotting and
+# NLP libraries are only imported when a chart is drawn or an unseen review has to be scored.
+import os
+import sys
+import threading
+import time
+
+from app_data import load_app_data
+from diagnostics import span
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+
+# Build everything the first rerun needs; returns [(stage, seconds)]
+def warm_caches(openfda_path=None):
+    timings = []
+    start = time.perf_counter()
+    with span("warm-up"):
+        data = load_app_data(openfda_path)
+        timings.append(("load_app_data", time.perf_counter() - start))
+        for name, build in (("period_counts", data.openfda_backend.period_counts),
+                            ("signals", data.openfda_backend.signals)):
+            stage_start = time.perf_counter()
+            build()
+            timings.append((name, time.perf_counter() - stage_start))
+
+        # Import the plotting library here as well, off the first session's critical path
+        stage_start = time.perf_counter()
+        import matplotlib.backends.backend_agg  # noqa: F401
+        import matplotlib.figure  # noqa: F401
+        timings.append(("import matplotlib", time.perf_counter() - stage_start))
+    return timings
+
+
+# Start the warm-up in a background thread (once per process); returns the thread
+def start_warmup(openfda_path=None):
+    global _warmup_thread
+
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_caches, args=(openfda_path,), name="cache-warmup",
+                                              daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def main():
+    args = sys.argv[1:]
+    if "--only" in args:
+        for name, seconds in warm_caches():
+            print(f"{name}: {seconds:.2f} s")
+        return
+
+    from streamlit.web import cli
+
+    start_warmup()
+    sys.argv = ["streamlit", "run", APP_PATH] + args
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()